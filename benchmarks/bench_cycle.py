@@ -0,0 +1,212 @@
+"""
+Сквозной бенчмарк цикла обработки.
+
+Поднимает заглушки TorAPI и Kinotam (benchmarks/fakes.py), запускает настоящий
+run_cycle из main.py на каталоге заданного размера и выводит:
+  - фильмов, попавших в конвейер за цикл, и фильмов в секунду;
+  - p50/p99 задержки по стадиям (список, поиск, фильтрация, magnet, загрузка);
+  - пиковый RSS процесса приложения.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_cycle.py --catalogue 2000 --torapi-latency 0.2 --torapi-errors 0.02
+    python benchmarks/bench_cycle.py --cycles 2 --json bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT / "benchmarks"))
+
+from fakes import TRACKERS, FakeOptions, FakeServers  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--catalogue", type=int, default=1000, help="фильмов в списке Kinotam")
+    parser.add_argument("--releases", type=int, default=20, help="релизов на фильм во всех трекерах")
+    parser.add_argument("--cycles", type=int, default=1)
+    parser.add_argument("--config", default=str(ROOT / "config.json"))
+    parser.add_argument("--torapi-latency", type=float, default=0.05)
+    parser.add_argument("--torapi-errors", type=float, default=0.0)
+    parser.add_argument("--kinotam-latency", type=float, default=0.02)
+    parser.add_argument("--kinotam-errors", type=float, default=0.0)
+    parser.add_argument("--telegram-throttle", type=float, default=0.0, help="доля ответов 429 от Telegram")
+    parser.add_argument("--incremental", action="store_true",
+                        help="после первого цикла синхронизировать список инкрементально")
+    parser.add_argument("--upload", action="store_true", help="загружать результат (DEBUG=false) вместо json")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="дополнительные настройки приложения, например SEARCH_MODE=trackers")
+    parser.add_argument("--json", help="сохранить отчет в файл")
+    return parser.parse_args()
+
+
+def configure_environment(args, servers: FakeServers, workdir: str):
+    env = {
+        "APP_NAME": "kcu_bench",
+        "URL": servers.kinotam_url,
+        "URL_ADMIN": servers.kinotam_url,
+        "TM": "bench",
+        "AUTH_METHOD": "request",
+        "URL_TORRENT": servers.torapi_url,
+        "TG_API_URL": servers.kinotam_url,
+        "TG_TOKEN": "bench",
+        "TG_CHAT_ID": "bench",
+        "TG_MIN_INTERVAL": "0",
+        "CONFIG_FILE": args.config,
+        "CAT_ID": "91",
+        "LIMIT": str(args.catalogue),
+        "MAX_LIMIT": "100",
+        "MAX_SIZE": "8",
+        "MIN_VIEWS": "50",
+        "TIME_SLEEP": "0",
+        "RESTART_TIME": "0",
+        "DB_NAME": "bench",
+        "TABLE_GOOD_QUALITY": "films_uploaded",
+        "TABLE_BAD_QUALITY": "films_bad_quality",
+        "DEBUG": "false" if args.upload else "true",
+        "GET_FILM_RETRIES": "3",
+        "GET_FILM_DELAY": "1",
+        "GET_MAGNET_RETRIES": "3",
+        "GET_MAGNET_DELAY": "0.1",
+        "KCU_BASE_PATH": workdir,
+        "PROFILES": "",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key.upper()] = value
+    os.environ.update(env)
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def instrument(app, kinotam_cls, timings):
+    """Оборачивает стадии конвейера так, чтобы замерять время каждого вызова"""
+
+    def timed(stage, func):
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timings[stage].append(time.perf_counter() - start)
+        return wrapper
+
+    app.search_film = timed("search", app.search_film)
+    app.select_release = timed("filter", app.select_release)
+    app.resolve_magnet = timed("magnet", app.resolve_magnet)
+    app.upload_result = timed("upload", app.upload_result)
+    kinotam_cls._fetch_chunk = timed("list", kinotam_cls._fetch_chunk)
+
+
+async def run(args, timings):
+    import httpx
+    import main as app
+    from config.settings import settings
+    from core.kinotam import Kinotam
+    from core.pipeline import UploadThrottle
+    from db.db import Database
+    from db.writer import DatabaseWriter
+
+    instrument(app, Kinotam, timings)
+    Database.init(settings)
+    DatabaseWriter.start(settings.db_write_batch_size)
+
+    cycles = []
+    async with httpx.AsyncClient(timeout=20.0) as client:
+        kinotam_api = await Kinotam.create(settings, client)
+        throttle = UploadThrottle(settings.time_sleep)
+        for index in range(args.cycles):
+            start = time.perf_counter()
+            searched = len(timings["search"])
+            full_sync = not args.incremental or index == 0
+            await app.run_cycle(settings, client, kinotam_api, throttle, full_sync)
+            # В инкрементальном цикле большая часть каталога в конвейер не попадает
+            cycles.append((time.perf_counter() - start, len(timings["search"]) - searched))
+        await kinotam_api.notifier.close()
+
+    DatabaseWriter.stop()
+    Database.close()
+    return cycles
+
+
+def main():
+    args = parse_args()
+
+    with open(args.config, encoding="utf-8") as f:
+        config = json.load(f)
+    options = FakeOptions(
+        catalogue=args.catalogue,
+        releases=args.releases,
+        torapi_latency=args.torapi_latency,
+        torapi_error_rate=args.torapi_errors,
+        kinotam_latency=args.kinotam_latency,
+        kinotam_error_rate=args.kinotam_errors,
+        telegram_throttle_rate=args.telegram_throttle,
+        categories={tracker: config.get(f"CATEGORIES_{tracker}", []) for tracker in TRACKERS},
+    )
+
+    original_cwd = os.getcwd()
+    with FakeServers(options) as servers, tempfile.TemporaryDirectory() as workdir:
+        configure_environment(args, servers, workdir)
+        # Приложение пишет БД и логи относительно текущей директории
+        os.chdir(workdir)
+        sys.path.insert(0, str(ROOT / "kcu"))
+
+        import logging
+        logging.disable(logging.INFO)
+
+        timings = defaultdict(list)
+        try:
+            cycles = asyncio.run(run(args, timings))
+        finally:
+            os.chdir(original_cwd)
+
+    peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    report = {
+        "catalogue": args.catalogue,
+        "cycles": [
+            {"seconds": round(seconds, 3), "films": films, "films_per_sec": round(films / seconds, 1)}
+            for seconds, films in cycles
+        ],
+        "stages": {
+            stage: {
+                "calls": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+            }
+            for stage, values in timings.items()
+        },
+        "peak_rss_mb": round(peak_rss_mb, 1),
+    }
+
+    for index, cycle in enumerate(report["cycles"], start=1):
+        print(f"Цикл {index}: {cycle['seconds']} с, фильмов {cycle['films']}, {cycle['films_per_sec']} фильмов/с")
+    print(f"{'Стадия':<10}{'вызовов':>10}{'p50, мс':>12}{'p99, мс':>12}")
+    for stage in ("list", "search", "filter", "magnet", "upload"):
+        if stage in report["stages"]:
+            data = report["stages"][stage]
+            print(f"{stage:<10}{data['calls']:>10}{data['p50_ms']:>12}{data['p99_ms']:>12}")
+    print(f"Пиковый RSS: {report['peak_rss_mb']} МБ")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+"""
+Проверка и микро-бенчмарк сопоставления названий раздач с фильмом.
+
+1. Прогоняет корпус названий раздач (benchmarks/data/name_corpus.json) через
+   старый путь (lookahead-регулярка из build_name_pattern) и NameMatcher,
+   сверяет оба с ожидаемым результатом и печатает расхождения.
+   Если NameMatcher ошибается хотя бы на одном примере, скрипт завершается с кодом 1.
+2. Сравнивает скорость на синтетических ответах: старый путь собирает регулярку
+   для каждого трекера, NameMatcher создается один раз на фильм.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_name_matcher.py --films 500 --releases 30
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "kcu"))
+
+from core.name_matcher import NameMatcher, get_name_matcher, normalize_tokens  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+TRACKERS = ("RuTracker", "Kinozal", "NoNameClub")
+
+
+def normalize_name_to_pattern(name: str) -> str:
+    """Старый путь из core/filters.py"""
+    parts = re.split(r'([.:—\-])', name)
+    pattern_parts = []
+    for part in parts:
+        if part in {'.', ':', '-', '—'}:
+            pattern_parts.append(r'[:.\-—]?')
+        else:
+            part = part.strip()
+            if part:
+                pattern_parts.append(rf"\b{re.escape(part)}\b")
+    return r'\s*'.join(pattern_parts)
+
+
+def build_name_pattern(local_name: str, orig_name: str = None, year: str = None) -> re.Pattern:
+    """Старый путь из core/filters.py"""
+    conditions = []
+    if local_name:
+        conditions.append(normalize_name_to_pattern(local_name))
+    if orig_name:
+        conditions.append(rf"\b{re.escape(orig_name)}\b")
+    if year:
+        conditions.append(rf"\b{re.escape(str(year))}\b")
+    pattern = ''.join(f"(?=.*{cond})" for cond in conditions) + ".*"
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def check_corpus(path: Path) -> bool:
+    with open(path, encoding="utf-8") as f:
+        corpus = json.load(f)
+
+    legacy_errors, matcher_errors = [], []
+    for case in corpus:
+        film = (case["name"], case["name_orig"], case["year"])
+        legacy = bool(build_name_pattern(*film).search(case["release"]))
+        fast = NameMatcher(*film).matches(case["release"])
+        if legacy != case["expected"]:
+            legacy_errors.append(case)
+        if fast != case["expected"]:
+            matcher_errors.append(case)
+
+    print(f"Корпус: {len(corpus)} названий раздач")
+    print(f"  регулярка:   ошибок {len(legacy_errors)}")
+    print(f"  NameMatcher: ошибок {len(matcher_errors)}")
+    for case in matcher_errors:
+        print(f"  ОШИБКА NameMatcher: {case['name']} / {case['name_orig']} ({case['year']}) -> "
+              f"{case['release']} (ожидалось {case['expected']}, токены {normalize_tokens(case['release'])})")
+    return not matcher_errors
+
+
+def synthetic_results(rng, corpus, films, releases):
+    """Ответы в формате /api/search/title/all: часть релизов подходит, часть нет"""
+    result_sets = []
+    for number in range(films):
+        case = rng.choice(corpus)
+        # Номер делает фильмы разными, чтобы кэш матчеров не подменял собой работу
+        film = (f"{case['name']} {number}", case["name_orig"] and f"{case['name_orig']} {number}", case["year"])
+        other = rng.choice(corpus)
+        raw = {}
+        for tracker in TRACKERS:
+            items = []
+            for _ in range(releases // len(TRACKERS)):
+                source = case if rng.random() < 0.5 else other
+                orig = f" / {film[1]}" if film[1] and source is case else (f" / {other['name_orig']}" if other["name_orig"] else "")
+                local = film[0] if source is case else other["name"]
+                year = source["year"]
+                tail = ", ".join(rng.sample(["США", "Россия", "драма", "комедия", "фантастика", "боевик", "криминал"], 4))
+                items.append({"Name": f"{local}{orig} (Режиссер Фамилия / Director Surname) [{year}, {tail}, BDRip 1080p] Dub + MVO + AVO + Original + Sub Rus, Eng"})
+            raw[tracker] = items
+        result_sets.append((film, raw))
+    return result_sets
+
+
+def legacy_filter(film, raw):
+    matched = 0
+    for items in raw.values():
+        # Как раньше: регулярка собирается заново для каждого трекера
+        pattern = build_name_pattern(*film)
+        matched += sum(1 for item in items if pattern.search(item["Name"]))
+    return matched
+
+
+def matcher_filter(film, raw):
+    matcher = get_name_matcher(*film)
+    return sum(1 for items in raw.values() for item in items if matcher.matches(item["Name"]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=str(ROOT / "benchmarks" / "data" / "name_corpus.json"))
+    parser.add_argument("--films", type=int, default=500)
+    parser.add_argument("--releases", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    corpus_ok = check_corpus(Path(args.corpus))
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    result_sets = synthetic_results(random.Random(args.seed), corpus, args.films, args.releases)
+
+    start = time.perf_counter()
+    legacy = [legacy_filter(film, raw) for film, raw in result_sets]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [matcher_filter(film, raw) for film, raw in result_sets]
+    fast_time = time.perf_counter() - start
+
+    total = sum(len(items) for _, raw in result_sets for items in raw.values())
+    print(f"Релизов: {total} ({args.films} фильмов)")
+    print(f"Регулярка:   {legacy_time * 1000:.1f} мс ({legacy_time / total * 1e6:.1f} мкс/релиз), совпадений {sum(legacy)}")
+    print(f"NameMatcher: {fast_time * 1000:.1f} мс ({fast_time / total * 1e6:.1f} мкс/релиз), совпадений {sum(fast)}")
+    print(f"Ускорение: x{legacy_time / fast_time:.1f}")
+
+    if not corpus_ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Микро-бенчмарк поиска тегов качества.
+
+Сравнивает старый путь (re.search по каждому тегу, сначала GOOD, потом BAD)
+с TagMatcher на синтетических ответах TorAPI и проверяет, что Tag/Priority совпадают.
+
+Запуск из корня репозитория:
+    python benchmarks/bench_tag_matcher.py --films 500 --releases 30
+"""
+import argparse
+import json
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "kcu"))
+
+from core.tag_matcher import TagMatcher  # noqa: E402
+
+ROOT = Path(__file__).resolve().parent.parent
+
+WORDS = [
+    "Дюна", "Часть", "вторая", "Dune", "Part", "Two", "Мастер", "и", "Маргарита", "Cats",
+    "Бригада", "Наследник", "Stats", "Top", "Gun", "Maverick", "Зеленая", "миля", "Green", "Mile",
+]
+EXTRAS = ["MVO", "DUB", "AVO", "Line", "Sub", "Eng", "Rus", "HEVC", "HDR", "SDR", "Open Matte"]
+
+
+def legacy_find(items, tags):
+    tag_priority = {tag: idx for idx, tag in enumerate(tags)}
+    matched = []
+    for item in items:
+        name = str(item.get("Name", ""))
+        for tag in tags:
+            pattern = re.escape(tag).replace(r"\ ", r"\s+")
+            if re.search(pattern, name, flags=re.IGNORECASE):
+                matched.append((id(item), tag, tag_priority[tag]))
+                break
+    return matched
+
+
+def matcher_find(matcher, items):
+    good, bad = [], []
+    for item in items:
+        good_match, bad_match = matcher.match(str(item.get("Name", "")))
+        if good_match:
+            good.append((id(item), good_match.tag, good_match.priority))
+        if bad_match:
+            bad.append((id(item), bad_match.tag, bad_match.priority))
+    return good, bad
+
+
+def synthetic_results(rng, films, releases, tags):
+    result_sets = []
+    for _ in range(films):
+        items = []
+        for _ in range(releases):
+            title = " ".join(rng.sample(WORDS, 3))
+            year = rng.randint(1950, 2025)
+            quality = rng.choice(tags + ["", "1080p", "720p", "UHD BDRemux 2160p"])
+            extras = ", ".join(rng.sample(EXTRAS, 3))
+            items.append({"Name": f"{title} ({year}) {quality} | {extras}"})
+        result_sets.append(items)
+    return result_sets
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--config", default=str(ROOT / "config.json"))
+    parser.add_argument("--films", type=int, default=500)
+    parser.add_argument("--releases", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with open(args.config, encoding="utf-8") as f:
+        config = json.load(f)
+    good_tags = config.get("GOOD_QUALITY", [])
+    bad_tags = config.get("BAD_QUALITY", [])
+
+    rng = random.Random(args.seed)
+    result_sets = synthetic_results(rng, args.films, args.releases, good_tags + bad_tags)
+
+    start = time.perf_counter()
+    legacy = [(legacy_find(items, good_tags), legacy_find(items, bad_tags)) for items in result_sets]
+    legacy_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matcher = TagMatcher(good_tags, bad_tags)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fast = [matcher_find(matcher, items) for items in result_sets]
+    fast_time = time.perf_counter() - start
+
+    if legacy != fast:
+        print("ОШИБКА: результаты TagMatcher отличаются от старого поиска")
+        sys.exit(1)
+
+    total = args.films * args.releases
+    print(f"Релизов: {total} ({args.films} фильмов x {args.releases})")
+    print(f"re.search по тегам: {legacy_time * 1000:.1f} мс ({legacy_time / total * 1e6:.1f} мкс/релиз)")
+    print(f"TagMatcher:         {fast_time * 1000:.1f} мс ({fast_time / total * 1e6:.1f} мкс/релиз), сборка {build_time * 1000:.2f} мс")
+    print(f"Ускорение: x{legacy_time / fast_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
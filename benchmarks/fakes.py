@@ -0,0 +1,232 @@
+"""
+Локальные заглушки TorAPI и Kinotam для бенчмарков.
+
+Серверы запускаются в отдельном процессе, чтобы их память и CPU не попадали
+в замеры приложения. Задержка, доля ошибок и размер каталога настраиваются
+через FakeOptions.
+"""
+import json
+import multiprocessing
+import random
+import socket
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+TRACKERS = ("RuTracker", "Kinozal", "NoNameClub")
+TAGS = (
+    "WEB-DL 1080p", "WEB-DLRip (1080p)", "BDRip 1080p", "WEB-DL 720p", "BDRip (720p)",
+    "HDRip", "WEB-DLRip", "DVDRip", "TS", "UHD BDRemux 2160p",
+)
+
+
+@dataclass
+class FakeOptions:
+    catalogue: int = 1000
+    releases: int = 20
+    min_views: int = 0
+    max_views: int = 500
+    torapi_latency: float = 0.05
+    torapi_error_rate: float = 0.0
+    kinotam_latency: float = 0.02
+    kinotam_error_rate: float = 0.0
+    # Доля ответов 429 на sendMessage, как при превышении лимитов Telegram
+    telegram_throttle_rate: float = 0.0
+    # Трекер -> категории, из которых берутся категории релизов
+    categories: dict = field(default_factory=dict)
+    seed: int = 1
+
+
+def catalogue_film(film_id: int, options: FakeOptions) -> dict:
+    rng = random.Random(options.seed * 1_000_003 + film_id)
+    return {
+        "id": film_id,
+        "name": f"Фильм номер {film_id}",
+        "name_orig": f"Movie number {film_id}",
+        "year": 1990 + film_id % 35,
+        "views_cnt": rng.randint(options.min_views, options.max_views),
+    }
+
+
+def tracker_releases(film_id: int, tracker: str, options: FakeOptions) -> list[dict]:
+    film = catalogue_film(film_id, options)
+    rng = random.Random(f"{options.seed}:{film_id}:{tracker}")
+    categories = options.categories.get(tracker) or ["Без категории"]
+    releases = []
+    for index in range(options.releases // len(TRACKERS) + 1):
+        tag = rng.choice(TAGS)
+        releases.append({
+            "Name": f"{film['name']} / {film['name_orig']} ({film['year']}) {tag} | MVO, Sub",
+            "Id": str(film_id * 1000 + index),
+            "Url": f"https://{tracker.lower()}.example/{film_id}/{index}",
+            "Size": f"{rng.uniform(0.7, 12):.2f} GB",
+            "Seeds": str(rng.randint(0, 300)),
+            "Peers": str(rng.randint(0, 50)),
+            "Date": "01.01.2025",
+            "Category": rng.choice(categories),
+        })
+    return releases
+
+
+def _film_id_from_query(query: str) -> int | None:
+    # Запрос имеет вид "Фильм номер 123 / Movie number 123 / 2008"
+    try:
+        return int(query.split(" / ")[0].rsplit(" ", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    options: FakeOptions
+    latency: float
+    error_rate: float
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status: int, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _simulate(self) -> bool:
+        """Задержка и случайная ошибка. Возвращает False, если уже ответили ошибкой"""
+        if self.latency:
+            time.sleep(random.uniform(self.latency * 0.5, self.latency * 1.5))
+        if self.error_rate and random.random() < self.error_rate:
+            self._reply(500, {"error": "fake error"})
+            return False
+        return True
+
+    def _form(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        data = parse_qs(self.rfile.read(length).decode()) if length else {}
+        return {key: values[0] for key, values in data.items()}
+
+
+class TorApiHandler(_Handler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = unquote(parse_qs(url.query).get("query", [""])[0])
+        if not self._simulate():
+            return
+
+        if url.path.startswith("/api/search/title/"):
+            target = url.path.rsplit("/", 1)[1]
+            film_id = _film_id_from_query(query)
+            if film_id is None:
+                return self._reply(200, {"Result": "No matches"})
+            if target == "all":
+                return self._reply(200, {
+                    tracker: tracker_releases(film_id, tracker, self.options) for tracker in TRACKERS
+                })
+            tracker = next((name for name in TRACKERS if name.lower() == target), None)
+            if tracker is None:
+                return self._reply(404, {"error": "unknown tracker"})
+            return self._reply(200, tracker_releases(film_id, tracker, self.options))
+
+        if url.path.startswith("/api/search/id/"):
+            return self._reply(200, [{"Magnet": f"magnet:?xt=urn:btih:{abs(hash(query)):040x}"}])
+
+        self._reply(404, {"error": "not found"})
+
+
+class KinotamHandler(_Handler):
+    def do_POST(self):
+        url = urlparse(self.path)
+        data = self._form()
+        if not self._simulate():
+            return
+
+        if url.path == "/api/session/login/":
+            return self._reply(200, {"attributes": {"sid": "bench-sid"}})
+
+        if url.path == "/api/films/upload/list/":
+            offset, limit = int(data.get("O", 0)), int(data.get("L", 0))
+            ids = range(offset + 1, min(offset + limit, self.options.catalogue) + 1)
+            return self._reply(200, {"items": [catalogue_film(film_id, self.options) for film_id in ids]})
+
+        if url.path == "/api/films/upload/add/":
+            return self._reply(200, {"code": "00000"})
+
+        # Telegram Bot API: /bot<token>/sendMessage
+        if url.path.endswith("/sendMessage"):
+            if self.options.telegram_throttle_rate and random.random() < self.options.telegram_throttle_rate:
+                return self._reply(429, {
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": 1},
+                })
+            return self._reply(200, {"ok": True, "result": {}})
+
+        self._reply(404, {"error": "not found"})
+
+    do_GET = do_POST
+
+
+def _serve(handler_base, port: int, options: FakeOptions, latency: float, error_rate: float):
+    handler = type(handler_base.__name__, (handler_base,), {
+        "options": options, "latency": latency, "error_rate": error_rate,
+    })
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    server.serve_forever()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f"Заглушка на порту {port} не запустилась")
+
+
+class FakeServers:
+    """Контекстный менеджер: поднимает заглушки TorAPI и Kinotam и останавливает их на выходе"""
+
+    def __init__(self, options: FakeOptions):
+        self.options = options
+        self.torapi_port = free_port()
+        self.kinotam_port = free_port()
+        self._processes: list[multiprocessing.Process] = []
+
+    @property
+    def torapi_url(self) -> str:
+        return f"http://127.0.0.1:{self.torapi_port}"
+
+    @property
+    def kinotam_url(self) -> str:
+        return f"http://127.0.0.1:{self.kinotam_port}"
+
+    def __enter__(self):
+        options = self.options
+        for handler, port, latency, error_rate in (
+            (TorApiHandler, self.torapi_port, options.torapi_latency, options.torapi_error_rate),
+            (KinotamHandler, self.kinotam_port, options.kinotam_latency, options.kinotam_error_rate),
+        ):
+            process = multiprocessing.Process(
+                target=_serve, args=(handler, port, options, latency, error_rate), daemon=True)
+            process.start()
+            self._processes.append(process)
+        for port in (self.torapi_port, self.kinotam_port):
+            _wait_for_port(port)
+        return self
+
+    def __exit__(self, *exc_info):
+        for process in self._processes:
+            process.terminate()
+        for process in self._processes:
+            process.join(timeout=5)
@@ -1,6 +1,11 @@
+import atexit
+import copy
+import json
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+import queue
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener, TimedRotatingFileHandler
 
 from config.settings import settings
 
@@ -9,7 +14,56 @@ os.makedirs("./logs", exist_ok=True)
 root_logger = logging.getLogger()
 root_logger.setLevel(logging.INFO)
 
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись - одна строка JSON. Данные фильма из FilmLogger попадают в отдельные поля"""
+
+    def format(self, record):
+        data = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in ("film_id", "film_name"):
+            if hasattr(record, field):
+                data[field] = getattr(record, field)
+        if record.exc_text:
+            data["exception"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False)
+
+
+class BoundedQueueHandler(QueueHandler):
+    """
+    Отправляет записи в очередь, запись в файл и консоль идет в отдельном потоке.
+    Сообщения длиннее max_length обрезаются, чтобы случайно залогированный
+    ответ API не превращался в мегабайты текста.
+    """
+
+    def __init__(self, log_queue, max_length: int):
+        super().__init__(log_queue)
+        self.max_length = max_length
+        self._exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        # Как в QueueHandler.prepare, но трассировка исключения остается в exc_text,
+        # отдельно от текста сообщения, и не обрезается
+        record = copy.copy(record)
+        message = record.getMessage()
+        if self.max_length and len(message) > self.max_length:
+            message = f"{message[:self.max_length]}... (обрезано, всего {len(message)} символов)"
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+        record.msg = record.message = message
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+if settings.log_format == "json":
+    formatter = JsonFormatter()
+else:
+    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 
 file_handler = TimedRotatingFileHandler(
     filename="./logs/app.log",
@@ -27,7 +81,48 @@ console_handler.setFormatter(formatter)
 if root_logger.hasHandlers():
     root_logger.handlers.clear()
 
-root_logger.addHandler(file_handler)
-root_logger.addHandler(console_handler)
+# Обработчики с файловым вводом-выводом работают в потоке QueueListener, а не в event loop
+log_queue = queue.SimpleQueue()
+root_logger.addHandler(BoundedQueueHandler(log_queue, settings.log_max_length))
+queue_listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+queue_listener.start()
+# При выходе дописываем все, что осталось в очереди
+atexit.register(queue_listener.stop)
 
 logger = logging.getLogger(f"{settings.app_name}")
+
+
+class FilmLogger(logging.LoggerAdapter):
+    """Логгер записей о конкретном фильме: id и название попадают в поля записи"""
+
+    def __init__(self, film):
+        super().__init__(logger, {"film_id": film.get('id'), "film_name": film.get('name')})
+        self.film = film
+
+    @property
+    def label(self) -> str:
+        """Описание фильма для текста сообщения"""
+        film = self.film
+        return f"{film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')})"
+
+
+class SkipSampler:
+    """
+    Выборочный лог однотипных сообщений о пропуске фильмов.
+
+    По каждой причине в лог попадает только каждое every-е сообщение (1 - все,
+    0 - ни одного), остальные только считаются. Итог по причинам выводится
+    через summary() в конце цикла.
+    """
+
+    def __init__(self, every: int):
+        self.every = every
+        self.counts = Counter()
+
+    def log(self, log: logging.LoggerAdapter | logging.Logger, reason: str, message: str):
+        self.counts[reason] += 1
+        if self.every and (self.counts[reason] - 1) % self.every == 0:
+            log.info(message)
+
+    def summary(self) -> str:
+        return ", ".join(f"{reason}: {count}" for reason, count in self.counts.most_common())
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+from typing import Any
+
+from core.tag_matcher import TagMatcher
+
+CATEGORY_PREFIX = "CATEGORIES_"
+RUSSIAN_CATEGORY_PREFIX = "RUSSIAN_CATEGORIES_"
+
+
+class ConfigError(ValueError):
+    """Конфиг-файл не читается или не прошел проверку"""
+
+
+@dataclass(frozen=True)
+class ReleaseConfig:
+    """
+    Снимок config.json, подготовленный для фильтрации раздач: категории по трекерам
+    в frozenset, собранный TagMatcher и ограничение размера. Снимок не меняется,
+    при перезагрузке конфига создается новый.
+
+    MAX_SIZE из config.json, если задан, важнее значения из окружения.
+    """
+    data: dict[str, Any]
+    categories: dict[str, frozenset[str]]
+    russian_categories: dict[str, frozenset[str]]
+    tag_matcher: TagMatcher
+    max_size: float
+    # Отпечаток содержимого: меняется при любом изменении тегов, категорий или MAX_SIZE
+    digest: str
+    # (mtime_ns, size) файла, из которого собран снимок
+    stamp: tuple[int, int] | None = field(default=None, compare=False)
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any], max_size: float, stamp=None) -> "ReleaseConfig":
+        def categories(prefix):
+            return {
+                key[len(prefix):]: frozenset(str(category) for category in value)
+                for key, value in data.items()
+                if key.startswith(prefix) and value
+            }
+
+        return cls(
+            data=data,
+            categories=categories(CATEGORY_PREFIX),
+            russian_categories=categories(RUSSIAN_CATEGORY_PREFIX),
+            tag_matcher=TagMatcher(data.get("GOOD_QUALITY") or [], data.get("BAD_QUALITY") or []),
+            max_size=float(data.get("MAX_SIZE", max_size)),
+            digest=hashlib.blake2b(
+                json.dumps([data, max_size], sort_keys=True, ensure_ascii=False).encode(), digest_size=16,
+            ).hexdigest(),
+            stamp=stamp,
+        )
+
+    @classmethod
+    def load(cls, path: str, max_size: float, strict: bool = True) -> "ReleaseConfig":
+        """
+        Читает и собирает снимок. При strict=True файл сначала проверяется
+        через validate_config и при ошибках выбрасывается ConfigError.
+        """
+        try:
+            stamp = file_stamp(path)
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise ConfigError(f"не удалось прочитать {path}: {e}") from e
+
+        if not isinstance(data, dict):
+            raise ConfigError(f"{path}: конфиг должен быть JSON-объектом")
+        if strict:
+            errors = validate_config(data)
+            if errors:
+                raise ConfigError("; ".join(errors))
+        return cls.from_dict(data, max_size, stamp)
+
+    def tracker_categories(self, tracker: str, russian: bool) -> frozenset[str]:
+        return (self.russian_categories if russian else self.categories).get(tracker, frozenset())
+
+    def trackers(self, russian: bool) -> list[str]:
+        """Трекеры, для которых заданы категории"""
+        return list(self.russian_categories if russian else self.categories)
+
+
+def file_stamp(path: str) -> tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def validate_config(data) -> list[str]:
+    """Список ошибок конфига, пустой, если конфиг можно применять"""
+    if not isinstance(data, dict):
+        return ["конфиг должен быть JSON-объектом"]
+
+    errors = []
+    for key in ("GOOD_QUALITY", "BAD_QUALITY"):
+        tags = data.get(key, [])
+        if not isinstance(tags, list) or not all(isinstance(tag, str) and tag.strip() for tag in tags):
+            errors.append(f"{key} должен быть списком непустых строк")
+    if not data.get("GOOD_QUALITY") and not data.get("BAD_QUALITY"):
+        errors.append("не заданы теги качества GOOD_QUALITY и BAD_QUALITY")
+
+    category_keys = [key for key in data if key.startswith((CATEGORY_PREFIX, RUSSIAN_CATEGORY_PREFIX))]
+    for key in category_keys:
+        value = data[key]
+        if not isinstance(value, list) or not all(isinstance(category, str) for category in value):
+            errors.append(f"{key} должен быть списком строк")
+    if not any(data.get(key) for key in category_keys):
+        errors.append("не заданы категории ни для одного трекера")
+
+    if "MAX_SIZE" in data:
+        max_size = data["MAX_SIZE"]
+        if isinstance(max_size, bool) or not isinstance(max_size, (int, float)) or max_size <= 0:
+            errors.append("MAX_SIZE должен быть положительным числом")
+
+    return errors
@@ -1,8 +1,8 @@
-import json
 import os
 from pathlib import Path
-from typing import Any, Dict
 
+from config.release_config import ConfigError, ReleaseConfig, file_stamp, validate_config
+from dotenv import dotenv_values
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -40,29 +40,72 @@ class Settings(BaseSettings):
     url: str
     tm: str
     auth_method: str
+    session_ttl: int = 86400
     url_torrent: str
+    torapi_concurrency: int = 10
+    torapi_min_concurrency: int = 2
+    torapi_max_concurrency: int = 30
+    torapi_target_latency: float = 15.0
+    search_mode: str = "all"
+    tracker_search_timeout: float = 20.0
     cat_id: int
     max_limit: int
+    kinotam_concurrency: int = 4
+    sync_mode: str = "full"
+    sync_full_every: int = 24
     limit: int
     config_file: str
+    config_reload_interval: int = 10
     tg_chat_id: str = ""
     tg_user_id: str = ""
     tg_token: str = ""
+    tg_api_url: str = "https://api.telegram.org"
+    tg_queue_size: int = 100
+    tg_retries: int = 3
+    tg_min_interval: float = 1.0
+    tg_digest: bool = False
     db_name: str
+    db_busy_timeout: float = 30.0
+    db_write_batch_size: int = 200
+    upload_journal_ttl: int = 604800
     debug: bool = True
     time_sleep: int
     restart_time: int
+    pipeline_queue_size: int = 50
+    schedule_mode: str = "list"
+    schedule_age_weight: float = 1.0
+    schedule_upgrade_weight: float = 1.0
+    cycle_time_budget: int = 0
+    cycle_search_budget: int = 0
+    metrics_port: int = 0
+    metrics_file: str = ""
+    metrics_interval: int = 30
+    log_format: str = "text"
+    log_max_length: int = 2000
+    log_skip_every: int = 1
     get_film_retries: int
     get_film_delay: int
     get_magnet_retries: int
     get_magnet_delay: float
+    get_magnet_max_delay: float = 30.0
+    magnet_cache_ttl: int = 86400
+    magnet_breaker_threshold: int = 5
+    magnet_breaker_timeout: int = 600
     max_size: int
     table_bad_quality: str
     table_good_quality: str
     min_views: int
-
-    # Приватное поле для хранения данных из конфиг-файла
-    _config_data: Dict[str, Any] = {}
+    profiles: str = ""
+    recheck_interval: int = 0
+    search_cache_ttl: int = 21600
+    search_cache_max_size: int = 10000
+    backoff_base_delay: int = 3600
+    backoff_max_delay: int = 604800
+    backoff_popular_views: int = 0
+    backoff_popular_factor: float = 0.25
+
+    # Приватное поле для хранения снимка конфиг-файла
+    _release_config: ReleaseConfig | None = None
 
     model_config = SettingsConfigDict(
         env_file=os.path.join(BASE_PATH, ".env"),
@@ -73,24 +116,68 @@ class Settings(BaseSettings):
     def __init__(self, **data):
         super().__init__(**data)
         # Загружаем данные из config_file при инициализации, как в оригинале
-        self._config_data = self._load_config()
+        self._release_config = self._load_config()
 
-    def _load_config(self) -> Dict[str, Any]:
+    def _load_config(self) -> ReleaseConfig:
         """Метод для загрузки данных из конфигурационного файла."""
         try:
-            with open(self.config_file, encoding='utf-8') as f:
-                return json.load(f)
-        except Exception as e:
+            release_config = ReleaseConfig.load(self.config_file, self.max_size, strict=False)
+        except ConfigError as e:
             print(f"Ошибка при загрузке конфигурационного файла: {e}")
-            return {}
+            return ReleaseConfig.from_dict({}, self.max_size)
+
+        errors = validate_config(release_config.data)
+        if errors:
+            print(f"Ошибки в конфигурационном файле {self.config_file}: {'; '.join(errors)}")
+        return release_config
+
+    def reload_config(self) -> bool:
+        """
+        Перечитывает config_file, если он изменился. Новый снимок проверяется
+        и подменяет старый целиком, при ошибке выбрасывается ConfigError
+        и продолжает действовать старый. Возвращает True, если снимок заменен.
+        """
+        if file_stamp(self.config_file) == self._release_config.stamp:
+            return False
+        self._release_config = ReleaseConfig.load(self.config_file, self.max_size)
+        return True
+
+    @property
+    def release_config(self) -> ReleaseConfig:
+        """Текущий снимок конфига. Для согласованности один вызов фильтрации работает с одним снимком"""
+        return self._release_config
 
     def get(self, key, default=None):
         """
         Получение значения из конфигурационных данных.
         Сохраняет точно такой же интерфейс, как в оригинале.
         """
-        return self._config_data.get(key, default)
+        return self._release_config.data.get(key, default)
+
+    def category_trackers(self, russian: bool) -> list[str]:
+        """Трекеры, для которых в конфиге заданы категории (CATEGORIES_<трекер> или RUSSIAN_CATEGORIES_<трекер>)"""
+        return self._release_config.trackers(russian)
 
 
 # Создание экземпляра настроек
 settings = Settings()
+
+
+def load_profiles() -> list[Settings]:
+    """
+    Профили для запуска в одном процессе.
+
+    PROFILES - список env-файлов через запятую (пути относительно BASE_PATH).
+    Значения из файла профиля важнее переменных окружения, отсутствующие
+    в файле параметры берутся из основного окружения. Если PROFILES не задан,
+    работает один профиль из основных настроек.
+    """
+    if not settings.profiles:
+        return [settings]
+
+    profiles = []
+    for env_file in settings.profiles.split(","):
+        env_path = os.path.join(BASE_PATH, env_file.strip())
+        values = {key.lower(): value for key, value in dotenv_values(env_path).items() if value is not None}
+        profiles.append(Settings(**values))
+    return profiles
@@ -0,0 +1,39 @@
+import asyncio
+
+from config.log_config import logger
+from config.release_config import ConfigError, file_stamp
+from config.settings import Settings
+
+
+async def watch_config(profiles: list[Settings], interval: float):
+    """
+    Раз в interval секунд проверяет config_file каждого профиля и при изменении
+    подменяет снимок конфига без перезапуска процесса. Конфиг с ошибками
+    не применяется, профиль продолжает работать со старым снимком.
+    """
+    # Ошибка по одной и той же версии файла логируется один раз
+    failed = {}
+    while True:
+        await asyncio.sleep(interval)
+        for profile in profiles:
+            key = profile.app_name
+            try:
+                stamp = file_stamp(profile.config_file)
+                if failed.get(key) == stamp:
+                    continue
+                if profile.reload_config():
+                    release_config = profile.release_config
+                    tag_matcher = release_config.tag_matcher
+                    logger.info(
+                        f"[{key}] Конфиг {profile.config_file} перезагружен: "
+                        f"тегов {len(tag_matcher.good_tags)}/{len(tag_matcher.bad_tags)}, "
+                        f"трекеров {len(release_config.categories)}/{len(release_config.russian_categories)}, "
+                        f"MAX_SIZE {release_config.max_size}")
+                failed.pop(key, None)
+            except OSError as e:
+                if failed.get(key) != "missing":
+                    failed[key] = "missing"
+                    logger.error(f"[{key}] Конфиг {profile.config_file} недоступен, работаю со старым: {e}")
+            except ConfigError as e:
+                failed[key] = stamp
+                logger.error(f"[{key}] Конфиг {profile.config_file} не применен, работаю со старым: {e}")
@@ -1,9 +1,17 @@
 import asyncio
+import random
 from typing import TypedDict
 
 import httpx
 from config.log_config import logger
 from config.settings import settings
+from core import fast_json, metrics
+from core.breaker import CircuitBreaker
+from core.limiter import AdaptiveLimiter, is_overload_error
+from core.singleflight import SingleFlight
+from db.db import Database
+from db.writer import DatabaseWriter
+from models.film import Release, decode_releases
 
 
 class SearchByNameResponse(TypedDict):
@@ -17,18 +25,152 @@ class SearchByNameResponse(TypedDict):
     Leechers: int
     Magnet: str
 
+class SearchError(Exception):
+    """Ни один трекер не вернул результат поиска"""
+    pass
+
+
+class CacheStats:
+    """Счетчики попаданий и промахов кэша, дублируются в метрику kcu_cache_requests_total"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+
+    def hit(self):
+        self.hits += 1
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result="hit")
+
+    def miss(self):
+        self.misses += 1
+        metrics.CACHE_REQUESTS.inc(cache=self.name, result="miss")
+
+    def __str__(self):
+        return f"попаданий {self.hits}, промахов {self.misses}"
+
+
+search_cache_stats = CacheStats("search")
+magnet_cache_stats = CacheStats("magnet")
+
+# Одинаковые одновременные запросы (дубли в списке, фильм и в списке, и в перепроверке)
+# выполняются один раз
+search_flights = SingleFlight("search")
+magnet_flights = SingleFlight("magnet")
+
+# Предохранители /api/search/id/<трекер>, по одному на трекер
+magnet_breakers: dict[str, CircuitBreaker] = {}
+
+# Общий на процесс лимит параллельных запросов к TorAPI (поиск и magnet-ссылки)
+torapi_limiter = AdaptiveLimiter(
+    "TorAPI",
+    initial=settings.torapi_concurrency,
+    floor=settings.torapi_min_concurrency,
+    ceiling=settings.torapi_max_concurrency,
+    target_latency=settings.torapi_target_latency,
+)
+metrics.LIMITER_LIMIT.set_function(lambda: torapi_limiter.limit, name=torapi_limiter.name)
+metrics.LIMITER_IN_FLIGHT.set_function(lambda: torapi_limiter.in_flight, name=torapi_limiter.name)
+metrics.LIMITER_WAITING.set_function(lambda: torapi_limiter.waiting, name=torapi_limiter.name)
+
+
 async def search_by_name(
     app_settings: settings,
     client: httpx.AsyncClient,
     query,
     target="all",
+    timeout: float | None = None,
 ) -> SearchByNameResponse:
-    response = await client.get(
-        f"{app_settings.url_torrent}/api/search/title/{target}",
-        params={"query": query}
-    )
-    response.raise_for_status()
-    return response.json()
+    use_cache = app_settings.search_cache_ttl > 0
+
+    if use_cache:
+        cached = Database.get_cached_search(query, target, app_settings.search_cache_ttl)
+        if cached is not None:
+            search_cache_stats.hit()
+            return cached
+        search_cache_stats.miss()
+
+    async def fetch():
+        async with torapi_limiter.slot():
+            # Таймаут httpx ограничивает каждую фазу запроса, а не весь запрос: трекер, который
+            # отдает ответ медленно, может превысить его многократно. Поэтому общий срок еще и здесь
+            async with asyncio.timeout(timeout):
+                with metrics.track_request("torapi", f"search_{target}"):
+                    response = await client.get(
+                        f"{app_settings.url_torrent}/api/search/title/{target}",
+                        params={"query": query},
+                        timeout=timeout or client.timeout,
+                    )
+                    response.raise_for_status()
+        result = fast_json.loads(response.content)
+
+        if use_cache:
+            DatabaseWriter.submit(Database.save_search_result, query, target, result, app_settings.search_cache_max_size)
+        return result
+
+    # Ответ общий для всех ожидающих: менять его нельзя, Release из него собираются заново
+    return await search_flights.run((app_settings.url_torrent, target, query), fetch)
+
+
+async def search_by_trackers(
+    app_settings: settings,
+    client: httpx.AsyncClient,
+    query,
+    trackers: list[str],
+) -> dict[str, list]:
+    """
+    Параллельный поиск по отдельным трекерам, у каждого запроса свой срок на весь
+    запрос (время ожидания места в лимите TorAPI в него не входит).
+    Результат в формате /api/search/title/all: {трекер: [релизы]}.
+    Трекеры, которые не ответили, в результат не попадают.
+    """
+    async def search_tracker(tracker):
+        try:
+            result = await search_by_name(
+                app_settings, client, query, target=tracker.lower(), timeout=app_settings.tracker_search_timeout)
+        except (httpx.HTTPError, ValueError, TimeoutError) as e:
+            logger.warning(f"Трекер {tracker} не ответил на поиск '{query}': {e!r}")
+            return tracker, None
+        # Если совпадений нет, TorAPI отвечает не списком, а объектом с полем Result
+        return tracker, result if isinstance(result, list) else []
+
+    results = await asyncio.gather(*(search_tracker(tracker) for tracker in trackers))
+    merged = {tracker: items for tracker, items in results if items is not None}
+
+    if trackers and not merged:
+        raise SearchError(f"Ни один трекер не ответил: {', '.join(trackers)}")
+    return merged
+
+
+async def search_releases(
+    app_settings: settings,
+    client: httpx.AsyncClient,
+    query,
+    russian: bool,
+) -> dict[str, list[Release]]:
+    """Поиск релизов фильма в режиме SEARCH_MODE, ответ сразу разбирается в Release"""
+    if app_settings.search_mode == "trackers":
+        trackers = app_settings.category_trackers(russian)
+        return decode_releases(await search_by_trackers(app_settings, client, query, trackers))
+    return decode_releases(await search_by_name(app_settings, client, query))
+
+
+def _magnet_breaker(app_settings: settings, tracker: str) -> CircuitBreaker:
+    breaker = magnet_breakers.get(tracker)
+    if breaker is None:
+        breaker = CircuitBreaker(
+            f"Magnet-ссылки {tracker}",
+            failure_threshold=app_settings.magnet_breaker_threshold,
+            reset_timeout=app_settings.magnet_breaker_timeout,
+        )
+        magnet_breakers[tracker] = breaker
+    return breaker
+
+
+def _backoff_delay(app_settings: settings, attempt: int) -> float:
+    """Экспоненциальная пауза между попытками со случайным разбросом в пределах половины паузы"""
+    delay = min(app_settings.get_magnet_delay * 2 ** (attempt - 1), app_settings.get_magnet_max_delay)
+    return delay / 2 + random.uniform(0, delay / 2)
 
 
 async def get_magnet_link(
@@ -36,28 +178,76 @@ async def get_magnet_link(
     client: httpx.AsyncClient,
     tracker: str,
     torrent_id: str,
+) -> str | None:
+    use_cache = app_settings.magnet_cache_ttl > 0
+    if use_cache:
+        cached = Database.get_cached_magnet(tracker, torrent_id, app_settings.magnet_cache_ttl)
+        if cached:
+            magnet_cache_stats.hit()
+            return cached
+        magnet_cache_stats.miss()
+
+    return await magnet_flights.run(
+        (app_settings.url_torrent, tracker, str(torrent_id)),
+        lambda: _fetch_magnet_link(app_settings, client, tracker, torrent_id, use_cache),
+    )
+
+
+async def _fetch_magnet_link(
+    app_settings: settings,
+    client: httpx.AsyncClient,
+    tracker: str,
+    torrent_id: str,
+    use_cache: bool,
 ) -> str | None:
     url = f"{app_settings.url_torrent}/api/search/id/{tracker.lower()}"
     params = {"query": torrent_id}
     retries = app_settings.get_magnet_retries
-    delay = app_settings.get_magnet_delay
+    breaker = _magnet_breaker(app_settings, tracker)
 
-    for attempt in range(1, retries + 1):
-        try:
-            response = await client.get(url, params=params)
-            response.raise_for_status()
-            result = response.json()
+    # Предохранитель считает только перегрузку трекера (таймауты, обрывы, 429, 5xx) и не больше
+    # одной ошибки на поиск ссылки. Ответ без magnet-ссылки значит, что трекер работает
+    overloaded = False
+    trial = False
+    try:
+        for attempt in range(1, retries + 1):
+            if not breaker.allow():
+                logger.warning(f"Трекер {tracker} временно недоступен, пропускаем magnet-ссылку id={torrent_id}")
+                return None
+            trial = breaker.state == CircuitBreaker.HALF_OPEN
+
+            try:
+                async with torapi_limiter.slot():
+                    with metrics.track_request("torapi", "magnet"):
+                        response = await client.get(url, params=params)
+                        response.raise_for_status()
+                overloaded = False
+                breaker.record_success()
+                result = fast_json.loads(response.content)
 
-            if result and isinstance(result, list) and "Magnet" in result[0]:
-                return result[0]["Magnet"]
+                if result and isinstance(result, list) and isinstance(result[0], dict) and "Magnet" in result[0]:
+                    magnet = result[0]["Magnet"]
+                    if use_cache:
+                        DatabaseWriter.submit(Database.save_magnet, tracker, torrent_id, magnet)
+                    return magnet
 
-            logger.warning(f"[Попытка {attempt}] Нет поля 'Magnet' в результате для tracker={tracker}, id={torrent_id}")
+                logger.warning(f"[Попытка {attempt}] Нет поля 'Magnet' в результате для tracker={tracker}, id={torrent_id}")
 
-        except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
-            logger.error(f"[Попытка {attempt}] Ошибка при получении magnet-ссылки: {e}")
+            except (httpx.HTTPError, KeyError, IndexError, ValueError) as e:
+                logger.error(f"[Попытка {attempt}] Ошибка при получении magnet-ссылки: {e}")
+                overloaded = is_overload_error(e)
+                if not overloaded and isinstance(e, httpx.HTTPStatusError):
+                    # Трекер ответил, например 404 на удаленную раздачу
+                    breaker.record_success()
 
-        if attempt < retries:
-            await asyncio.sleep(delay)
+            if attempt < retries:
+                await asyncio.sleep(_backoff_delay(app_settings, attempt))
+    finally:
+        if overloaded:
+            breaker.record_failure()
+        elif trial:
+            # Пробный запрос без результата (отмена, неразобранный ответ) не должен занимать предохранитель
+            breaker.release_trial()
 
     logger.error(f"Не удалось получить magnet-ссылку после {retries} попыток: tracker={tracker}, id={torrent_id}")
     return None
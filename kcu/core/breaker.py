@@ -0,0 +1,65 @@
+import time
+
+from config.log_config import logger
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для недоступного сервиса.
+
+    После failure_threshold ошибок подряд предохранитель размыкается и запросы
+    не выполняются reset_timeout секунд. Затем пропускается один пробный запрос:
+    успех замыкает предохранитель, ошибка снова размыкает его.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_progress = False
+
+    def allow(self) -> bool:
+        """Можно ли сейчас выполнять запрос"""
+        if self.state == self.CLOSED:
+            return True
+
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.state = self.HALF_OPEN
+            self._trial_in_progress = False
+
+        # Полуоткрытое состояние: пропускаем только один пробный запрос
+        if self._trial_in_progress:
+            return False
+        self._trial_in_progress = True
+        return True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"{self.name}: сервис снова отвечает")
+        self.state = self.CLOSED
+        self._failures = 0
+        self._trial_in_progress = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"{self.name}: {self._failures} ошибок подряд, пропускаем запросы {self.reset_timeout / 60:.0f} мин")
+            self.state = self.OPEN
+            self._opened_at = time.monotonic()
+            self._trial_in_progress = False
+
+    def release_trial(self):
+        """Снимает пробный запрос без результата, например отмененный: следующий запрос станет пробным"""
+        if self.state == self.HALF_OPEN:
+            self._trial_in_progress = False
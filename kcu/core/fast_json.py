@@ -0,0 +1,24 @@
+"""
+Разбор и сериализация JSON для ответов TorAPI и кэша.
+
+Если установлен orjson, используется он: разбор ответов поиска заметно быстрее.
+Без него работает стандартный json, поведение то же.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data: str | bytes):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
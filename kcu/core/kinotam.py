@@ -1,10 +1,15 @@
-import time
+import asyncio
+import hashlib
 from datetime import datetime
 from typing import TypedDict
 
-import requests
+import httpx
 from config.log_config import logger
 from config.settings import Settings
+from core import metrics
+from db.db import Database
+from db.writer import DatabaseWriter
+from notifiers.telegram import TelegramNotifier
 from selenium import webdriver
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
@@ -21,8 +26,14 @@ class CookiesDict(TypedDict):
     csrf: str
     sid: str
 
+# Ответы, после которых сессия считается недействительной
+AUTH_ERROR_STATUSES = {401, 403}
+
+
 class Kinotam:
-    def __init__(self, app_settings: Settings):
+    def __init__(self, app_settings: Settings, client: httpx.AsyncClient, notifier: TelegramNotifier | None = None):
+        self.client = client
+        self.notifier = notifier or TelegramNotifier.from_settings(app_settings, client)
         self.url = app_settings.url
         self.url_admin = app_settings.url_admin
         self.tm = app_settings.tm
@@ -30,21 +41,83 @@ class Kinotam:
         self.cat_id = app_settings.cat_id
         self.limit = app_settings.limit
         self.max_limit = app_settings.max_limit
-        self.tg_chat_id = app_settings.tg_chat_id
         self.tg_user_id = app_settings.tg_user_id
-        self.tg_token = app_settings.tg_token
-
-        self.cookies = self.get_cookies()
-
-    def get_cookies(self, max_retries=3, delay=2):
+        self.concurrency = app_settings.kinotam_concurrency
+        self.session_ttl = app_settings.session_ttl
+
+        # Сессия хранится в БД и общая для процессов с одинаковыми URL и TM
+        tm_hash = hashlib.sha256(self.tm.encode()).hexdigest()[:16]
+        self._session_key = f"{self.url}|{self.auth_method}|{tm_hash}"
+        self._login_lock = asyncio.Lock()
+
+        self.cookies: CookiesDict | None = None
+
+    @classmethod
+    async def create(
+        cls,
+        app_settings: Settings,
+        client: httpx.AsyncClient,
+        notifier: TelegramNotifier | None = None,
+    ) -> "Kinotam":
+        """Создает клиент и сразу подготавливает сессию"""
+        kinotam = cls(app_settings, client, notifier)
+        await kinotam.ensure_session()
+        return kinotam
+
+    async def ensure_session(self):
+        """Берет сохраненную сессию, если она еще действует, иначе авторизуется"""
+        if self.cookies:
+            return
+
+        saved = Database.get_session(self._session_key)
+        if saved:
+            logger.info("Использую сохраненную сессию Kinotam")
+            self.cookies = saved
+            return
+
+        await self.refresh_session()
+
+    async def refresh_session(self, failed_cookies: CookiesDict | None = None):
+        """
+        Получает новую сессию. Если ее уже обновил другой запрос или другой процесс,
+        повторная авторизация не выполняется.
+        """
+        async with self._login_lock:
+            if failed_cookies is not None and self.cookies != failed_cookies:
+                return
+
+            saved = Database.get_session(self._session_key)
+            if saved and saved != failed_cookies:
+                self.cookies = saved
+                return
+
+            self.cookies = await self.get_cookies()
+            if self.cookies:
+                DatabaseWriter.submit(Database.save_session, self._session_key, self.cookies, self.session_ttl)
+
+    async def _post(self, api_url, data) -> httpx.Response:
+        """POST с куками сессии. При ошибке авторизации сессия обновляется и запрос повторяется"""
+        cookies = self.cookies
+        response = await self.client.post(api_url, data=data, headers=self._cookie_header())
+        if response.status_code in AUTH_ERROR_STATUSES:
+            logger.warning(f"Сессия Kinotam недействительна ({response.status_code}), обновляю")
+            await self.refresh_session(failed_cookies=cookies)
+            response = await self.client.post(api_url, data=data, headers=self._cookie_header())
+        return response
+
+    async def get_cookies(self, max_retries=3, delay=2):
         if self.auth_method == "browser":
-            return self._get_cookies_with_browser()
+            # Selenium блокирующий, поэтому уводим его из event loop в поток
+            return await asyncio.to_thread(self._get_cookies_with_browser)
         elif self.auth_method == "request":
-            return self._get_cookies_with_request(max_retries, delay)
+            return await self._get_cookies_with_request(max_retries, delay)
         else:
             logger.error(f"Неизвестный метод аутентификации: {self.auth_method}")
             raise ConfigurationError()
 
+    def _cookie_header(self) -> dict:
+        return {"Cookie": "; ".join(f"{key}={value}" for key, value in (self.cookies or {}).items())}
+
     def _get_cookies_with_browser(self) -> CookiesDict | None:
         options = Options()
         options.add_argument('--headless')
@@ -70,7 +143,7 @@ class Kinotam:
         finally:
             driver.quit()
 
-    def _get_cookies_with_request(
+    async def _get_cookies_with_request(
         self,
         max_retries,
         delay,
@@ -78,15 +151,15 @@ class Kinotam:
         api_url = f"{self.url}/api/session/login/"
         data = {"tm": self.tm}
         cookies_dict = {"sandbox": "beta"}
-        session = requests.Session()
 
         logger.info("Получаю sid через HTTP-запрос")
 
         for attempt in range(1, max_retries + 1):
             try:
                 logger.info(f"Попытка {attempt}: отправка запроса на {api_url}")
-                response = session.post(api_url, data=data)
-                response.raise_for_status()
+                with metrics.track_request("kinotam", "login"):
+                    response = await self.client.post(api_url, data=data)
+                    response.raise_for_status()
                 json_response = response.json()
                 sid = json_response.get('attributes', {}).get('sid')
 
@@ -101,19 +174,15 @@ class Kinotam:
 
             except Exception as e:
                 logger.warning(f"Ошибка при попытке {attempt}: {e}")
-                time.sleep(delay)
+                await asyncio.sleep(delay)
 
         logger.error("Превышено максимальное число попыток получения sid")
         return None
 
-    def get_films_to_process(self, max_retries=3, delay=2):  # TODO переделать на async
-        api_url = self.url + "/api/films/upload/list/"
-        session = requests.Session()
-        session.cookies.update(self.cookies)
-
+    def _chunks(self):
+        """Разбивает LIMIT на страницы (offset, limit) не больше MAX_LIMIT"""
         total_limit = self.limit
         start_offset = 0
-        result = []
 
         num_full_requests = total_limit // self.max_limit
         last_chunk = total_limit % self.max_limit
@@ -127,43 +196,115 @@ class Kinotam:
             chunks.append(
                 (start_offset + num_full_requests * self.max_limit, last_chunk)
             )
+        return chunks
 
-        for offset, limit in chunks:
-            data = {
-                "Ot": self.cat_id,
-                "O": offset,
-                "L": limit,
-                "_origin": self.url,
-            }
+    async def _fetch_chunk(self, semaphore, offset, limit, max_retries, delay):
+        api_url = self.url + "/api/films/upload/list/"
+        data = {
+            "Ot": self.cat_id,
+            "O": offset,
+            "L": limit,
+            "_origin": self.url,
+        }
 
+        async with semaphore:
+            refreshed = False
             for attempt in range(1, max_retries + 1):
                 logger.info(f"Попытка {attempt}: Получаю фильмы с OFFSET={offset}, LIMIT={limit}")
                 try:
-                    response = session.post(api_url, data=data)
-                    response.raise_for_status()
+                    cookies = self.cookies
+                    with metrics.track_request("kinotam", "list"):
+                        response = await self._post(api_url, data)
+                        response.raise_for_status()
 
                     json_response = response.json()
                     items = json_response.get("items")
 
                     if items:
-                        logger.info(f"Получаю данные O={offset}, L={limit}: {items}")
-                        result.extend(items)
-                        break
-                    else:
-                        logger.warning(f"Список фильмов пустой (попытка {attempt})")
-                        time.sleep(delay)
+                        logger.info(f"Получено {len(items)} фильмов O={offset}, L={limit}")
+                        return items
+
+                    # На истекшую сессию Kinotam может ответить 200 без списка: ответ без items
+                    # или повторно пустая первая страница. Сессия обновляется один раз за страницу
+                    if not refreshed and ("items" not in json_response or (offset == 0 and attempt > 1)):
+                        logger.warning(f"Kinotam вернул пустой список (попытка {attempt}), обновляю сессию")
+                        await self.refresh_session(failed_cookies=cookies)
+                        refreshed = True
+                        continue
+
+                    logger.warning(f"Список фильмов пустой (попытка {attempt})")
+                    await asyncio.sleep(delay)
 
                 except Exception as e:
                     logger.warning(
                         f"Ошибка при получении списка фильмов (попытка {attempt}): {e}"
                     )
-                    time.sleep(delay)
-        if not result:
+                    await asyncio.sleep(delay)
+        return []
+
+    async def iter_films_to_process(self, max_retries=3, delay=2):
+        """
+        Список фильмов на обработку. Страницы запрашиваются параллельно, не больше
+        self.concurrency одновременно, и отдаются в порядке списка. Если список
+        дочитывать не нужно, незавершенные запросы страниц отменяются.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        pages = [
+            asyncio.create_task(self._fetch_chunk(semaphore, offset, limit, max_retries, delay))
+            for offset, limit in self._chunks()
+        ]
+        received = 0
+        try:
+            for page in pages:
+                items = await page
+                received += len(items)
+                yield items
+        finally:
+            for page in pages:
+                page.cancel()
+
+        if not received:
             logger.error("Не удалось получить фильмы после всех попыток")
-        logger.info(f"Фильмы на обработку: {result}")
-        return result
 
-    def upload_film(self, film):
+    async def iter_changed_films(self, max_retries=3, delay=2):
+        """
+        Инкрементальная синхронизация списка.
+
+        Страницы запрашиваются по порядку, по self.concurrency одновременно.
+        Дальше отдаются только фильмы, которых нет в копии списка в БД или у которых
+        изменился views_cnt. На первой странице, где все фильмы уже известны
+        и не изменились, получение списка заканчивается.
+        """
+        semaphore = asyncio.Semaphore(self.concurrency)
+        chunks = self._chunks()
+        changed_count = 0
+        for start in range(0, len(chunks), self.concurrency):
+            pages = await asyncio.gather(*(
+                self._fetch_chunk(semaphore, offset, limit, max_retries, delay)
+                for offset, limit in chunks[start:start + self.concurrency]
+            ))
+            for number, page in enumerate(pages, start=start + 1):
+                if not page:
+                    continue
+
+                known = Database.get_catalogue_fingerprints(self.cat_id, (film.get('id') for film in page))
+                changed = [
+                    film for film in page
+                    if known.get(film.get('id')) != int(film.get('views_cnt') or 0)
+                ]
+                if not changed:
+                    logger.info(
+                        f"Страница {number} из {len(chunks)} без изменений, остальные страницы не запрашиваю. "
+                        f"Новых или измененных фильмов: {changed_count}")
+                    return
+
+                changed_count += len(changed)
+                yield changed
+
+        logger.info(f"Новых или измененных фильмов: {changed_count}")
+
+    async def upload_film(self, film) -> bool:
+        """Загружает фильм. True, если фильм есть на сайте: загружен сейчас или был загружен раньше"""
 
         data = {
             "Ot": self.cat_id,
@@ -173,13 +314,11 @@ class Kinotam:
         }
 
         api_url = self.url + '/api/films/upload/add/'
-        session = requests.Session()
-        session.cookies.update(self.cookies)
 
         target_name = (
             "Фильм" if self.cat_id == 91 else "Мультфильм" if self.cat_id == 104 else ""
         )
-        logger.info(f"Добавляю {target_name} на сайт {film}")
+        logger.info(f"Добавляю {target_name} на сайт [{film.get('id')}] {film.get('name_to_api')}")
         link_path = (
             "movie" if self.cat_id == 91
             else "cartoon" if self.cat_id == 104
@@ -187,31 +326,33 @@ class Kinotam:
         )
 
         try:
-            response = session.post(api_url, data=data)
+            with metrics.track_request("kinotam", "upload"):
+                response = await self._post(api_url, data)
             json_response = response.json()
-            if json_response.get("code") == "00000":
+            code = json_response.get("code")
+            if code == "00000":
                 logger.info(f"Добавил {target_name}. {json_response}, ")
                 self.send_message_tg(film, f"✅ *Залил {target_name}:*", link_path)
-            elif json_response.get("code") == "00037":
+                return True
+            elif code == "00037":
                 logger.warning(f"Загружен дубль. {json_response}, ")
                 self.send_message_tg(film, "⚠️ *Попытка повторной загрузки:*", link_path)
+                return True
             else:
                 logger.warning(f"Ошибка при загрузке {target_name.lower()}a. {json_response}, ")
-                self.send_message_tg(film, f"⛔️ *Ошибка при загрузке {target_name.lower()}a ({json_response.get("code")}):*", link_path)
-
-            return response
+                self.send_message_tg(film, f"⛔️ *Ошибка при загрузке {target_name.lower()}a ({code}):*", link_path)
+                return False
 
         except Exception as e:
-            logger.warning(f"Ошибка при добавлении {target_name.lower()}а")
-            return 'Ошибка ', e
+            logger.warning(f"Ошибка при добавлении {target_name.lower()}а: {e}")
+            return False
 
     def send_message_tg(self, film, message_status, link_path):
-        url = f'https://api.telegram.org/bot{self.tg_token}/sendMessage'
-
+        """Ставит уведомление о загрузке в очередь TelegramNotifier"""
         message = (
             f"{message_status}\n"
             f"\n"
-            f"*Дата загрузки:* {datetime.now().strftime("%d.%m.%Y %H:%M")}\n"
+            f"*Дата загрузки:* {datetime.now().strftime('%d.%m.%Y %H:%M')}\n"
             f"*ID:* `{film.get('id')}`\n"
             f"*Название:* `{film.get('name_to_api')}`\n"
             f"*Название раздачи:* `{film.get('name_release')}`\n"
@@ -219,12 +360,5 @@ class Kinotam:
             f"[🔗 Фильм на Kinotam]({self.url}/{link_path}/?Oi={film.get('id')})\n"
             f"[🔗 Ссылка на раздачу]({film.get('url')})\n"
         )
-
-        payload = {
-            'chat_id': self.tg_chat_id,
-            'text': message,
-            'parse_mode': 'Markdown'
-        }
-        logger.info("Отправка уведомления в telegram")
-        requests.post(url, data=payload)
-
+        summary = f"{message_status} `{film.get('name_to_api')}` (ID `{film.get('id')}`)"
+        self.notifier.notify(message, summary)
@@ -0,0 +1,107 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import httpx
+from config.log_config import logger
+
+
+def is_overload_error(error: BaseException) -> bool:
+    """Ошибки, которые говорят о перегрузке сервиса: таймауты, обрывы соединения, 429 и 5xx"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, TimeoutError))
+
+
+class AdaptiveLimiter:
+    """
+    Ограничение числа параллельных запросов по схеме AIMD.
+
+    Каждые limit успешных быстрых ответов лимит растет на единицу (не выше ceiling).
+    Ответ медленнее target_latency или ошибка перегрузки уменьшает лимит
+    в decrease_factor раз (не ниже floor). Уменьшение происходит не чаще
+    раза в target_latency секунд, чтобы пачка одновременных таймаутов
+    не обрушила лимит до минимума.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial: int,
+        floor: int,
+        ceiling: int,
+        target_latency: float,
+        decrease_factor: float = 0.5,
+    ):
+        self.name = name
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.target_latency = target_latency
+        self.decrease_factor = decrease_factor
+
+        self._limit = float(min(max(initial, self.floor), self.ceiling))
+        self._in_flight = 0
+        self._waiting = 0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self):
+        """Занимает место на время запроса и учитывает его задержку и результат"""
+        async with self._condition:
+            self._waiting += 1
+            try:
+                await self._condition.wait_for(lambda: self._in_flight < self.limit)
+            finally:
+                self._waiting -= 1
+            self._in_flight += 1
+
+        start = time.monotonic()
+        overloaded = False
+        try:
+            yield
+        except Exception as e:
+            overloaded = is_overload_error(e)
+            raise
+        finally:
+            self._record(time.monotonic() - start, overloaded)
+            async with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _record(self, latency: float, overloaded: bool):
+        if overloaded or latency > self.target_latency:
+            self._successes = 0
+            now = time.monotonic()
+            if now - self._last_decrease < self.target_latency:
+                return
+            self._last_decrease = now
+            old_limit = self.limit
+            self._limit = max(float(self.floor), self._limit * self.decrease_factor)
+            if self.limit != old_limit:
+                reason = "ошибка" if overloaded else f"ответ за {latency:.1f} с"
+                logger.warning(f"Лимит {self.name}: {old_limit} -> {self.limit} ({reason})")
+            return
+
+        self._successes += 1
+        if self._successes >= self.limit and self._limit < self.ceiling:
+            self._successes = 0
+            self._limit = min(float(self.ceiling), self._limit + 1)
+            logger.debug(f"Лимит {self.name}: {self.limit}")
+
+    def __str__(self):
+        return f"лимит {self.limit} (от {self.floor} до {self.ceiling}), в работе {self._in_flight}, в очереди {self._waiting}"
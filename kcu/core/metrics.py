@@ -0,0 +1,260 @@
+"""
+Метрики приложения в текстовом формате Prometheus.
+
+Без внешних зависимостей: счетчики, гистограммы и показатели хранятся в памяти
+процесса. Снаружи они доступны по HTTP (/metrics на METRICS_PORT) и/или
+в файле METRICS_FILE, который перезаписывается каждые METRICS_INTERVAL секунд.
+"""
+import asyncio
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable
+
+from config.log_config import logger
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0, 5.0)
+CYCLE_BUCKETS = (10.0, 30.0, 60.0, 300.0, 600.0, 1800.0, 3600.0, 7200.0, 21600.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Метрика {self.name} ожидает метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: tuple) -> dict:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self):
+        """Пары (имя, метки, значение) для вывода"""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines += [f"{name}{_format_labels(labels)} {_format_value(value)}" for name, labels, value in self.samples()]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Монотонно растущий счетчик"""
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value
+
+
+class Gauge(_Metric):
+    """Текущее значение: задается явно или вычисляется функцией при каждом чтении"""
+    type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def set_function(self, func: Callable[[], float], **labels):
+        with self._lock:
+            self._values[self._key(labels)] = func
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield self.name, self._labels(key), value() if callable(value) else value
+
+
+class Histogram(_Metric):
+    """Распределение значений по корзинам, плюс сумма и количество"""
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Замеряет время выполнения блока, в том числе завершившегося исключением"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: list[_Metric] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "kcu_stage_duration_seconds", "Время обработки фильма на стадии конвейера", ("stage",)))
+STAGE_RESULTS = REGISTRY.register(Counter(
+    "kcu_stage_results_total", "Результаты стадий конвейера: ok, skipped, error", ("stage", "result")))
+PIPELINE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "kcu_pipeline_queue_depth", "Фильмов в очереди перед стадией", ("profile", "stage")))
+
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "kcu_request_duration_seconds", "Время HTTP-запросов к внешним сервисам", ("service", "operation")))
+REQUEST_ERRORS = REGISTRY.register(Counter(
+    "kcu_request_errors_total", "Ошибки HTTP-запросов к внешним сервисам", ("service", "operation")))
+
+CACHE_REQUESTS = REGISTRY.register(Counter(
+    "kcu_cache_requests_total", "Обращения к кэшам: hit или miss", ("cache", "result")))
+COALESCED_CALLS = REGISTRY.register(Counter(
+    "kcu_coalesced_calls_total", "Запросы, которые дождались такого же уже выполняющегося запроса", ("name",)))
+
+LIMITER_LIMIT = REGISTRY.register(Gauge(
+    "kcu_limiter_limit", "Текущий лимит параллельных запросов", ("name",)))
+LIMITER_IN_FLIGHT = REGISTRY.register(Gauge(
+    "kcu_limiter_in_flight", "Запросов в работе", ("name",)))
+LIMITER_WAITING = REGISTRY.register(Gauge(
+    "kcu_limiter_waiting", "Запросов, ожидающих места в лимите", ("name",)))
+
+DB_DURATION = REGISTRY.register(Histogram(
+    "kcu_db_duration_seconds", "Время операций с БД, включая ожидание блокировки", ("kind",), DB_BUCKETS))
+DB_WRITE_QUEUE = REGISTRY.register(Gauge(
+    "kcu_db_write_queue", "Записей в очереди отложенной записи в БД"))
+
+CYCLE_DURATION = REGISTRY.register(Histogram(
+    "kcu_cycle_duration_seconds", "Длительность цикла обработки профиля", ("profile",), CYCLE_BUCKETS))
+CYCLE_LAST_SUCCESS = REGISTRY.register(Gauge(
+    "kcu_cycle_last_success_timestamp_seconds", "Время окончания последнего цикла", ("profile",)))
+
+
+@contextmanager
+def track_request(service: str, operation: str):
+    """Время запроса к внешнему сервису и счетчик ошибок"""
+    with REQUEST_DURATION.time(service=service, operation=operation):
+        try:
+            yield
+        except Exception:
+            REQUEST_ERRORS.inc(service=service, operation=operation)
+            raise
+
+
+def render() -> str:
+    return REGISTRY.render()
+
+
+def write_file(path: str):
+    """Записывает метрики атомарно: читатель видит либо старый, либо новый файл целиком"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(render())
+    os.replace(tmp_path, path)
+
+
+async def write_periodically(path: str, interval: float):
+    """Перезаписывает файл метрик каждые interval секунд"""
+    while True:
+        try:
+            write_file(path)
+        except OSError as e:
+            logger.warning(f"Не удалось записать метрики в {path}: {e}")
+        await asyncio.sleep(interval)
+
+
+async def _handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их надо дочитать
+        while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = "200 OK", render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int, host: str = "0.0.0.0") -> asyncio.Server:
+    """HTTP-сервер с одной страницей /metrics"""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info(f"Метрики доступны на http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,73 @@
+import re
+from functools import lru_cache
+
+_APOSTROPHES = re.compile(r"[’'`ʼ]")
+_SEPARATORS = re.compile(r"[\W_]+")
+
+
+def _to_roman(number: int) -> str:
+    result = ""
+    for value, numeral in ((10, "x"), (9, "ix"), (5, "v"), (4, "iv"), (1, "i")):
+        while number >= value:
+            result += numeral
+            number -= value
+    return result
+
+
+# Римские номера частей приводятся к арабским: "Rocky II" и "Rocky 2" дают одинаковые токены
+_ROMAN_NUMERALS = {_to_roman(number): str(number) for number in range(1, 40)}
+
+
+@lru_cache(maxsize=16384)
+def normalize_tokens(text: str) -> tuple[str, ...]:
+    """
+    Токены названия: нижний регистр, ё -> е, апострофы удаляются,
+    остальная пунктуация и пробелы считаются разделителями, римские числа до XXXIX
+    заменяются арабскими.
+    """
+    text = _APOSTROPHES.sub("", text.lower().replace("ё", "е"))
+    return tuple(_ROMAN_NUMERALS.get(token, token) for token in _SEPARATORS.split(text) if token)
+
+
+def _contains_sequence(tokens: tuple[str, ...], sequence: tuple[str, ...]) -> bool:
+    """Есть ли sequence в tokens подряд"""
+    first, size = sequence[0], len(sequence)
+    start = 0
+    while True:
+        try:
+            index = tokens.index(first, start)
+        except ValueError:
+            return False
+        if tokens[index:index + size] == sequence:
+            return True
+        start = index + 1
+
+
+class NameMatcher:
+    """
+    Проверка, что название раздачи относится к фильму.
+
+    Название на русском и оригинальное название должны встречаться в названии
+    раздачи целиком, слово за словом, а год - отдельным токеном. Названия
+    сравниваются по токенам из normalize_tokens, поэтому различия в регистре,
+    ё/е, пунктуации и записи номера части (II/2) не мешают совпадению.
+    """
+
+    def __init__(self, local_name: str | None, orig_name: str | None = None, year=None):
+        self._sequences = [
+            tokens for tokens in (normalize_tokens(name) for name in (local_name, orig_name) if name) if tokens
+        ]
+        self._year = str(year) if year else None
+
+    def matches(self, release_name: str) -> bool:
+        # Токены названий раздач кэширует normalize_tokens, отдельный кэш результатов не нужен
+        tokens = normalize_tokens(release_name)
+        if self._year is not None and self._year not in tokens:
+            return False
+        return all(_contains_sequence(tokens, sequence) for sequence in self._sequences)
+
+
+@lru_cache(maxsize=2048)
+def get_name_matcher(local_name: str | None, orig_name: str | None = None, year=None) -> NameMatcher:
+    """NameMatcher для фильма, создается один раз на набор названий и год"""
+    return NameMatcher(local_name, orig_name, year)
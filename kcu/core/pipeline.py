@@ -0,0 +1,102 @@
+import asyncio
+import time
+from typing import Any, AsyncIterable, Awaitable, Callable, NamedTuple
+
+from config.log_config import logger
+from core import metrics
+
+# Маркер конца потока: проходит по очередям от источника до последней стадии
+_DONE = object()
+
+
+class Stage(NamedTuple):
+    name: str
+    handler: Callable[[Any], Awaitable[Any]]
+    workers: int = 1
+
+
+async def run_pipeline(source: AsyncIterable, stages: list[Stage], queue_size: int, name: str = ""):
+    """
+    Запускает стадии, связанные ограниченными очередями.
+
+    Каждая стадия обрабатывает элементы в workers параллельных обработчиках и передает
+    результат следующей стадии. Если обработчик вернул None, элемент дальше не идет.
+    Результат последней стадии отбрасывается. Заполненная очередь останавливает
+    предыдущую стадию, поэтому в памяти одновременно не больше queue_size
+    элементов на стадию.
+
+    Время и результат каждого вызова обработчика и глубина очередей
+    учитываются в метриках, name различает конвейеры разных профилей.
+    """
+    queues = [asyncio.Queue(maxsize=queue_size) for _ in stages]
+    for stage, queue in zip(stages, queues):
+        metrics.PIPELINE_QUEUE_DEPTH.set_function(queue.qsize, profile=name, stage=stage.name)
+
+    async def produce():
+        try:
+            async for item in source:
+                await queues[0].put(item)
+        except Exception as e:
+            logger.exception(f"Ошибка при получении данных для обработки: {e}")
+        finally:
+            await queues[0].put(_DONE)
+
+    async def worker(stage: Stage, in_queue: asyncio.Queue, out_queue: asyncio.Queue | None):
+        while True:
+            item = await in_queue.get()
+            if item is _DONE:
+                # Возвращаем маркер, чтобы остановились и соседние обработчики стадии
+                await in_queue.put(_DONE)
+                return
+
+            start = time.perf_counter()
+            try:
+                result = await stage.handler(item)
+            except Exception as e:
+                logger.exception(f"Ошибка на стадии {stage.name}: {e}")
+                metrics.STAGE_RESULTS.inc(stage=stage.name, result="error")
+                continue
+            finally:
+                metrics.STAGE_DURATION.observe(time.perf_counter() - start, stage=stage.name)
+
+            # Последняя стадия ничего не возвращает, для нее None - обычный результат
+            skipped = result is None and out_queue is not None
+            metrics.STAGE_RESULTS.inc(stage=stage.name, result="skipped" if skipped else "ok")
+            if result is not None and out_queue is not None:
+                await out_queue.put(result)
+
+    async def run_stage(index: int, stage: Stage):
+        out_queue = queues[index + 1] if index + 1 < len(queues) else None
+        try:
+            await asyncio.gather(*(worker(stage, queues[index], out_queue) for _ in range(stage.workers)))
+        finally:
+            if out_queue is not None:
+                await out_queue.put(_DONE)
+
+    try:
+        await asyncio.gather(produce(), *(run_stage(index, stage) for index, stage in enumerate(stages)))
+    finally:
+        for stage in stages:
+            metrics.PIPELINE_QUEUE_DEPTH.remove(profile=name, stage=stage.name)
+
+
+class UploadThrottle:
+    """
+    Выдерживает паузу не меньше interval секунд между загрузками.
+    Создается один раз на процесс, поэтому пауза соблюдается и между циклами.
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._last_upload: float | None = None
+
+    async def wait(self):
+        if self._last_upload is None:
+            return
+        delay = self._last_upload + self.interval - time.monotonic()
+        if delay > 0:
+            logger.info(f"Ждем {delay / 60:.1f} минут до следующей отправки")
+            await asyncio.sleep(delay)
+
+    def mark(self):
+        self._last_upload = time.monotonic()
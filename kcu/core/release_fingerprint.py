@@ -0,0 +1,34 @@
+import hashlib
+from dataclasses import dataclass
+
+from models.film import Release
+
+
+def release_key(release: Release) -> str:
+    """Короткий ключ раздачи по трекеру, id и названию: переименованная раздача считается новой"""
+    data = f"{release.tracker}\0{release.id}\0{release.name}".encode()
+    return hashlib.blake2b(data, digest_size=8).hexdigest()
+
+
+@dataclass(frozen=True, slots=True)
+class ReleaseFingerprint:
+    """
+    Отпечаток набора раздач фильма из ответа поиска.
+
+    Хранит ключи всех раздач и отпечаток конфига, с которым они проверялись:
+    после смены тегов или категорий старые раздачи нужно проверить заново.
+    """
+    keys: frozenset[str]
+    config_digest: str
+
+    @classmethod
+    def of(cls, releases: dict[str, list[Release]], config_digest: str) -> "ReleaseFingerprint":
+        return cls(frozenset(release_key(item) for items in releases.values() for item in items), config_digest)
+
+    def new_releases(self, releases: dict[str, list[Release]]) -> dict[str, list[Release]]:
+        """Раздачи, которых не было в этом отпечатке"""
+        new = {
+            tracker: [item for item in items if release_key(item) not in self.keys]
+            for tracker, items in releases.items()
+        }
+        return {tracker: items for tracker, items in new.items() if items}
@@ -0,0 +1,67 @@
+import math
+import time
+
+from models.film import FilmTask
+
+# Возраст последней проверки учитывается не больше чем за столько недель
+MAX_AGE_WEEKS = 4.0
+
+
+class CycleBudget:
+    """
+    Ограничение работы за цикл: время с начала цикла в секундах и число
+    поисков в TorAPI. 0 - без ограничения.
+    """
+
+    def __init__(self, max_seconds: float = 0, max_searches: int = 0):
+        self.max_seconds = max_seconds
+        self.max_searches = max_searches
+        self.started_at = time.monotonic()
+        self.searches = 0
+
+    @property
+    def exhausted(self) -> bool:
+        if self.max_seconds and time.monotonic() - self.started_at >= self.max_seconds:
+            return True
+        return bool(self.max_searches) and self.searches >= self.max_searches
+
+    def take(self) -> bool:
+        """Учитывает один поиск. False, если бюджет уже исчерпан"""
+        if self.exhausted:
+            return False
+        self.searches += 1
+        return True
+
+    def __str__(self):
+        elapsed = time.monotonic() - self.started_at
+        return (
+            f"поисков {self.searches}/{self.max_searches or '∞'}, "
+            f"время {elapsed:.0f}/{self.max_seconds or '∞'} с"
+        )
+
+
+def film_value(task: FilmTask, now: float, age_weight: float = 1.0, upgrade_weight: float = 1.0) -> float:
+    """
+    Ценность обработки фильма в этом цикле.
+
+    Складывается из популярности (десятичный логарифм views_cnt), времени с последней
+    проверки (age_weight за неделю, не больше MAX_AGE_WEEKS недель, фильм без
+    проверок считается самым давним) и бонуса upgrade_weight за возможность
+    заменить релиз плохого качества.
+    """
+    film = task.film
+    value = math.log10(1 + max(int(film.get('views_cnt') or 0), 0))
+
+    last_checked_at = film.get('last_checked_at')
+    age_weeks = MAX_AGE_WEEKS if last_checked_at is None else (now - last_checked_at) / (7 * 24 * 3600)
+    value += age_weight * min(max(age_weeks, 0.0), MAX_AGE_WEEKS)
+
+    if task.update_mode:
+        value += upgrade_weight
+    return value
+
+
+def rank_tasks(tasks: list[FilmTask], age_weight: float = 1.0, upgrade_weight: float = 1.0) -> list[FilmTask]:
+    """Фильмы по убыванию ценности, при равной ценности сохраняется исходный порядок"""
+    now = time.time()
+    return sorted(tasks, key=lambda task: film_value(task, now, age_weight, upgrade_weight), reverse=True)
@@ -0,0 +1,65 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable, TypeVar
+
+from core import metrics
+
+T = TypeVar("T")
+
+
+class _LeaderCancelled(Exception):
+    """Вызов, выполнявший общий запрос, отменен"""
+
+
+class SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов.
+
+    Пока вызов с ключом key выполняется, повторные вызовы с тем же ключом
+    не запускают свой запрос, а ждут первый и получают его результат или
+    исключение. Отмена ожидающего вызова не отменяет общий запрос, а при отмене
+    вызова, выполняющего запрос, его повторяет один из ожидающих.
+    Число сэкономленных вызовов считается в saved и в метрике kcu_coalesced_calls_total.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.saved = 0
+        self._calls: dict[Hashable, asyncio.Future] = {}
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        while (call := self._calls.get(key)) is not None:
+            try:
+                result = await asyncio.shield(call)
+            except _LeaderCancelled:
+                # Ключ уже освобожден: первый проснувшийся выполнит запрос, остальные будут ждать его
+                continue
+            except Exception:
+                self._coalesced()
+                raise
+            self._coalesced()
+            return result
+
+        call = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await func()
+        except asyncio.CancelledError:
+            call.set_exception(_LeaderCancelled())
+            call.exception()
+            raise
+        except BaseException as e:
+            call.set_exception(e)
+            # Исключение получит вызывающий код, ожидающих может и не быть
+            call.exception()
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    def _coalesced(self):
+        self.saved += 1
+        metrics.COALESCED_CALLS.inc(name=self.name)
+
+    def __str__(self):
+        return f"объединено запросов {self.saved}, в работе {len(self._calls)}"
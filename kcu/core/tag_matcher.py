@@ -0,0 +1,91 @@
+import re
+from typing import Iterable, NamedTuple
+
+
+class TagMatch(NamedTuple):
+    tag: str
+    priority: int
+
+
+def _tag_to_pattern(tag: str) -> str:
+    return re.escape(tag).replace(r"\ ", r"\s+")
+
+
+class TagMatcher:
+    """
+    Поиск тегов качества в названии раздачи за один проход.
+
+    Все теги GOOD_QUALITY и BAD_QUALITY собираются в одно регулярное выражение.
+    Совпадения ищутся через lookahead на каждой позиции строки, поэтому для каждой
+    позиции находится тег с наименьшим индексом в списке. Минимум по всем позициям
+    дает тот же тег, что и последовательный перебор тегов по порядку.
+    """
+
+    def __init__(self, good_tags: Iterable[str], bad_tags: Iterable[str]):
+        self.good_tags = tuple(good_tags)
+        self.bad_tags = tuple(bad_tags)
+
+        # Для дублей приоритет берется по последнему вхождению, как в словаре tag_priority
+        self._good_priority = {tag: idx for idx, tag in enumerate(self.good_tags)}
+        self._bad_priority = {tag: idx for idx, tag in enumerate(self.bad_tags)}
+
+        # В шаблон попадает только первое вхождение тега: оно и совпадает первым
+        good_unique = list(dict.fromkeys(self.good_tags))
+        bad_unique = list(dict.fromkeys(self.bad_tags))
+        self._good_unique = good_unique
+        self._bad_unique = bad_unique
+        self._good_count = len(good_unique)
+
+        # Номер группы = позиция тега: сначала хорошие теги, затем плохие
+        good_alternatives = [f"({_tag_to_pattern(tag)})" for tag in good_unique]
+        bad_alternatives = [f"({_tag_to_pattern(tag)})" for tag in bad_unique]
+
+        good = "|".join(good_alternatives)
+        bad = "|".join(bad_alternatives)
+
+        if good and bad:
+            # Быстрый отсев позиций, где не начинается ни один тег, затем захват лучших тегов
+            any_tag = "|".join(_tag_to_pattern(tag) for tag in good_unique + bad_unique)
+            pattern = f"(?=(?:{any_tag}))(?:(?={good})|)(?:(?={bad})|)"
+        elif good:
+            pattern = f"(?={good})"
+        elif bad:
+            pattern = f"(?={bad})"
+        else:
+            pattern = None
+
+        self._pattern = re.compile(pattern, re.IGNORECASE) if pattern else None
+
+    def match(self, name: str) -> tuple[TagMatch | None, TagMatch | None]:
+        """Возвращает (лучший хороший тег, лучший плохой тег) для названия раздачи."""
+        if self._pattern is None:
+            return None, None
+
+        best_good = None
+        best_bad = None
+        good_count = self._good_count
+
+        for m in self._pattern.finditer(name):
+            # Последняя совпавшая группа: плохой тег, если он есть на этой позиции, иначе хороший
+            last = m.lastindex
+            if last > good_count:
+                bad = last - good_count - 1
+                if best_bad is None or bad < best_bad:
+                    best_bad = bad
+                good = next((i for i, value in enumerate(m.groups()[:good_count]) if value is not None), None)
+            else:
+                good = last - 1
+            if good is not None and (best_good is None or good < best_good):
+                best_good = good
+            if best_good == 0 and best_bad == 0:
+                break
+
+        return (
+            self._to_match(self._good_unique[best_good], self._good_priority) if best_good is not None else None,
+            self._to_match(self._bad_unique[best_bad], self._bad_priority) if best_bad is not None else None,
+        )
+
+    @staticmethod
+    def _to_match(tag: str, priority: dict[str, int]) -> TagMatch:
+        return TagMatch(tag, priority[tag])
+
@@ -1,19 +1,65 @@
+import json
 import os
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from pathlib import Path
 
 from config.log_config import logger
-from config.settings import settings
+from config.settings import Settings, settings
+from core import fast_json, metrics
+from core.release_fingerprint import ReleaseFingerprint
+from db.migrations import MIGRATIONS
+from models.film import Film, FilmState, FilmStatus, Release, UploadState
+
+# Время создания записи сохраняется, остальные поля обновляются
+_UPSERT_FILM_STATE = '''
+    INSERT INTO film_state (
+        cat_id, id, name, name_orig, year, status,
+        tag, priority, release_id, tracker,
+        created_at, updated_at, last_checked_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (cat_id, id) DO UPDATE SET
+        name = excluded.name,
+        name_orig = excluded.name_orig,
+        year = excluded.year,
+        status = excluded.status,
+        tag = excluded.tag,
+        priority = excluded.priority,
+        release_id = excluded.release_id,
+        tracker = excluded.tracker,
+        updated_at = excluded.updated_at,
+        last_checked_at = excluded.last_checked_at
+'''
 
 
 class Database:
     """
-    Класс для соединения с БД
+    Класс для соединения с БД.
+
+    На процесс открывается соединение для записи в режиме WAL: файл БД общий для
+    контейнеров kcu и kcu-mult, поэтому при блокировке ждем busy_timeout,
+    а не падаем. Доступ к соединению из разных потоков защищен блокировкой.
+
+    Чтение идет через отдельное соединение со своей блокировкой: в режиме WAL
+    чтение не ждет записи, поэтому поиск в event loop не останавливается, пока
+    поток записи ждет блокировку БД в BEGIN IMMEDIATE.
     """
     db_filename = settings.db_name + '_test' if settings.debug else settings.db_name
     DB_DIR = "./db_base"
     DB_PATH = Path(f"{DB_DIR}/{db_filename}.db")
 
+    _conn: sqlite3.Connection | None = None
+    _lock = threading.RLock()
+    _transaction_depth = 0
+    # Поток, в котором открыта транзакция: его чтение идет через соединение записи
+    _transaction_thread: int | None = None
+
+    _read_conn: sqlite3.Connection | None = None
+    _read_lock = threading.Lock()
+
     @classmethod
     def ensure_db_dir_exists(cls):
         """Создает директорию для БД, если она не существует"""
@@ -22,86 +68,417 @@ class Database:
             os.makedirs(cls.DB_DIR, exist_ok=True)
 
     @classmethod
-    def connect(cls):
-        """Подключение к БД с предварительной проверкой существования директории"""
-        cls.ensure_db_dir_exists()
+    def connect(cls) -> sqlite3.Connection:
+        """Возвращает соединение процесса, при первом вызове открывает его"""
+        with cls._lock:
+            if cls._conn is not None:
+                return cls._conn
 
-        # Проверяем, существует ли файл БД
-        db_exists = os.path.exists(cls.DB_PATH)
-        if not db_exists:
-            logger.info(f"Создаю новую базу данных: {cls.DB_PATH}")
-        else:
-            logger.info(f"Подключаюсь к существующей БД: {cls.DB_PATH}")
+            cls.ensure_db_dir_exists()
+
+            # Проверяем, существует ли файл БД
+            db_exists = os.path.exists(cls.DB_PATH)
+            if not db_exists:
+                logger.info(f"Создаю новую базу данных: {cls.DB_PATH}")
+            else:
+                logger.info(f"Подключаюсь к существующей БД: {cls.DB_PATH}")
+
+            conn = cls._open()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            cls._conn = conn
+
+            # Соединение для чтения открывается сразу, чтобы первое чтение не ждало блокировку записи
+            if cls._read_conn is None:
+                read_conn = cls._open()
+                read_conn.execute("PRAGMA query_only=ON")
+                cls._read_conn = read_conn
+            return conn
+
+    @classmethod
+    def connect_read(cls) -> sqlite3.Connection:
+        """Возвращает соединение для чтения"""
+        if cls._read_conn is None:
+            cls.connect()
+        return cls._read_conn
 
-        return sqlite3.connect(cls.DB_PATH)
+    @classmethod
+    def _open(cls) -> sqlite3.Connection:
+        # isolation_level=None: транзакциями управляем сами в transaction()
+        conn = sqlite3.connect(
+            cls.DB_PATH,
+            timeout=settings.db_busy_timeout,
+            isolation_level=None,
+            check_same_thread=False,
+        )
+        conn.execute(f"PRAGMA busy_timeout={int(settings.db_busy_timeout * 1000)}")
+        return conn
 
     @classmethod
-    def init(cls):
-        """Инициализация БД: создание таблиц, если они не существуют"""
-        cls.ensure_db_dir_exists()
+    def close(cls):
+        """Закрывает соединения процесса"""
+        with cls._read_lock:
+            if cls._read_conn is not None:
+                cls._read_conn.close()
+                cls._read_conn = None
+        with cls._lock:
+            if cls._conn is not None:
+                cls._conn.close()
+                cls._conn = None
+                logger.info("Соединение с БД закрыто")
 
-        with cls.connect() as conn:
-            cursor = conn.cursor()
+    @classmethod
+    @contextmanager
+    def transaction(cls):
+        """
+        Транзакция на общем соединении. Все запросы внутри фиксируются одним COMMIT,
+        вложенные вызовы выполняются в рамках внешней транзакции.
+        """
+        start = time.perf_counter()
+        with cls._lock:
+            conn = cls.connect()
+            outermost = cls._transaction_depth == 0
+            if outermost:
+                conn.execute("BEGIN IMMEDIATE")
+                cls._transaction_thread = threading.get_ident()
+            cls._transaction_depth += 1
+            try:
+                yield conn.cursor()
+            except BaseException:
+                cls._transaction_depth -= 1
+                if outermost:
+                    cls._transaction_thread = None
+                    conn.execute("ROLLBACK")
+                raise
+            cls._transaction_depth -= 1
+            if outermost:
+                cls._transaction_thread = None
+                conn.execute("COMMIT")
+                metrics.DB_DURATION.observe(time.perf_counter() - start, kind="write")
+
+    @classmethod
+    @contextmanager
+    def cursor(cls):
+        """
+        Курсор для чтения без явной транзакции. Внутри транзакции того же потока
+        читает через соединение записи, чтобы видеть еще не зафиксированные изменения.
+        """
+        start = time.perf_counter()
+        if cls._transaction_thread == threading.get_ident():
+            lock, connect = cls._lock, cls.connect
+        else:
+            lock, connect = cls._read_lock, cls.connect_read
+        with lock:
+            try:
+                yield connect().cursor()
+            finally:
+                metrics.DB_DURATION.observe(time.perf_counter() - start, kind="read")
 
-            # Создаем таблицу для фильмов плохого качества
-            logger.info(
-                f"Создаю таблицу {settings.table_bad_quality} (если не существует)")
-            cursor.execute(f'''
-                CREATE TABLE IF NOT EXISTS {settings.table_bad_quality} (
-                    id INTEGER PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    name_orig TEXT,
-                    year INTEGER
+    @classmethod
+    def init(cls, app_settings: Settings = settings):
+        """Инициализация БД: применение миграций, которые еще не применялись"""
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version    INTEGER NOT NULL,
+                    cat_id     INTEGER NOT NULL,
+                    name       TEXT NOT NULL,
+                    applied_at REAL NOT NULL,
+                    PRIMARY KEY (version, cat_id)
                 )
             ''')
+            cursor.execute('SELECT version FROM schema_migrations WHERE cat_id = ?', (app_settings.cat_id,))
+            applied = {row[0] for row in cursor.fetchall()}
 
-            # Создаем таблицу для фильмов хорошего качества
-            logger.info(
-                f"Создаю таблицу {settings.table_good_quality} (если не существует)")
-            cursor.execute(f'''
-               CREATE TABLE IF NOT EXISTS {settings.table_good_quality} (
-                   id        INTEGER PRIMARY KEY,
-                   name      TEXT NOT NULL,
-                   name_orig TEXT,
-                   year      INTEGER
-               )
-            ''')
+            for version, name, migration in MIGRATIONS:
+                if version in applied:
+                    continue
+                logger.info(f"Применяю миграцию {version}: {name}")
+                migration(cursor, app_settings)
+                cursor.execute(
+                    'INSERT INTO schema_migrations (version, cat_id, name, applied_at) VALUES (?, ?, ?, ?)',
+                    (version, app_settings.cat_id, name, time.time()))
 
-            logger.info("Инициализация БД завершена")
+        logger.info("Инициализация БД завершена")
 
     @classmethod
-    def save_film(cls, film, table_name):
-        with cls.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(f'''
-                INSERT OR IGNORE INTO {table_name} (id, name, name_orig, year)
-                VALUES (?, ?, ?, ?)
-            ''', (film['id'], film['name'], film.get('name_orig'),
-                  film.get('year')))
+    def journal_upload(cls, cat_id, film, status: FilmStatus, item: Release, payload: dict):
+        """
+        Записывает в журнал загрузок фильм с выбранным релизом и данными для загрузки.
+        Предыдущая запись фильма в журнале заменяется.
+        """
+        now = time.time()
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO upload_journal (
+                    cat_id, id, state, name, name_orig, year, status,
+                    tag, priority, release_id, tracker, payload,
+                    created_at, updated_at
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (
+                cat_id, film['id'], UploadState.RESOLVED, film['name'], film.get('name_orig'), film.get('year'),
+                status, item.tag, item.priority, item.id, item.tracker, fast_json.dumps(payload),
+                now, now,
+            ))
 
     @classmethod
-    def get_all_films(cls, table_name):
-        with cls.connect() as conn:
-            cursor = conn.cursor()
+    def set_upload_state(cls, cat_id, film_id, state: UploadState):
+        with cls.transaction() as cursor:
             cursor.execute(
-                f'SELECT id, name, name_orig, year FROM {table_name}')
+                'UPDATE upload_journal SET state = ?, updated_at = ? WHERE cat_id = ? AND id = ?',
+                (state, time.time(), cat_id, film_id))
+
+    @classmethod
+    def complete_upload(cls, cat_id, film_id):
+        """
+        Отмечает загрузку выполненной и той же транзакцией сохраняет состояние фильма
+        с релизом из журнала. До этого фильм не считается обработанным.
+        """
+        now = time.time()
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                SELECT name, name_orig, year, status, tag, priority, release_id, tracker
+                FROM upload_journal
+                WHERE cat_id = ? AND id = ?
+            ''', (cat_id, film_id))
+            row = cursor.fetchone()
+            if row is None:
+                return
+            cursor.execute(_UPSERT_FILM_STATE, (cat_id, film_id, *row, now, now, now))
+            cursor.execute(
+                'UPDATE upload_journal SET state = ?, updated_at = ? WHERE cat_id = ? AND id = ?',
+                (UploadState.UPLOADED, now, cat_id, film_id))
+
+    @classmethod
+    def get_pending_uploads(cls, cat_id) -> list[dict]:
+        """Данные для загрузки фильмов, которые остались в журнале незалитыми, в порядке записи"""
+        with cls.cursor() as cursor:
+            cursor.execute(
+                'SELECT payload FROM upload_journal WHERE cat_id = ? AND state IN (?, ?) ORDER BY created_at',
+                (cat_id, UploadState.RESOLVED, UploadState.UPLOADING))
+            return [fast_json.loads(row[0]) for row in cursor.fetchall()]
+
+    @classmethod
+    def prune_upload_journal(cls, cat_id, before):
+        """Удаляет завершенные записи журнала, обновленные раньше before"""
+        with cls.transaction() as cursor:
+            cursor.execute(
+                'DELETE FROM upload_journal WHERE cat_id = ? AND state IN (?, ?) AND updated_at < ?',
+                (cat_id, UploadState.UPLOADED, UploadState.FAILED, before))
+            return cursor.rowcount
+
+    @classmethod
+    def get_films_by_status(cls, cat_id, status: FilmStatus, checked_before=None) -> list[FilmState]:
+        """
+        Фильмы с указанным статусом. Если задан checked_before, только те,
+        что не проверялись с этого момента (или не проверялись вовсе).
+        views_cnt берется из копии списка Kinotam, если фильм в ней есть.
+        """
+        query = '''
+            SELECT s.id, s.name, s.name_orig, s.year, s.status, s.tag, s.priority, s.release_id, s.tracker,
+                   s.last_checked_at, m.views_cnt
+            FROM film_state s
+            LEFT JOIN catalogue_mirror m ON m.cat_id = s.cat_id AND m.id = s.id
+            WHERE s.cat_id = ? AND s.status = ?
+        '''
+        params = [cat_id, status]
+        if checked_before is not None:
+            query += ' AND (s.last_checked_at IS NULL OR s.last_checked_at < ?)'
+            params.append(checked_before)
+
+        with cls.cursor() as cursor:
+            cursor.execute(query, params)
             rows = cursor.fetchall()
 
-            films = []
-            for row in rows:
-                film = {
-                    "id": row[0],
-                    "name": row[1],
-                    "name_orig": row[2],
-                    "year": row[3],
-                }
-                films.append(film)
+        return [
+            FilmState(
+                id=row[0], name=row[1], name_orig=row[2], year=row[3], status=FilmStatus(row[4]),
+                tag=row[5], priority=row[6], release_id=row[7], tracker=row[8], last_checked_at=row[9],
+                views_cnt=row[10] or 0,
+            )
+            for row in rows
+        ]
+
+    @classmethod
+    def get_known_ids(cls, cat_id):
+        """Id всех фильмов категории, уже записанных в film_state (залитых в любом качестве)"""
+        with cls.cursor() as cursor:
+            cursor.execute('SELECT id FROM film_state WHERE cat_id = ?', (cat_id,))
+            return {row[0] for row in cursor.fetchall()}
+
+    @classmethod
+    def mark_checked(cls, cat_id, film_ids):
+        """Обновляет время последней проверки для пачки фильмов"""
+        with cls.transaction() as cursor:
+            cursor.executemany(
+                'UPDATE film_state SET last_checked_at = ? WHERE cat_id = ? AND id = ?',
+                [(time.time(), cat_id, film_id) for film_id in film_ids])
 
-            return films
+    @classmethod
+    def save_catalogue_films(cls, cat_id, films):
+        """Запоминает фильмы из списка Kinotam вместе с views_cnt, при котором они были обработаны"""
+        now = time.time()
+        with cls.transaction() as cursor:
+            cursor.executemany('''
+                INSERT OR REPLACE INTO catalogue_mirror (cat_id, id, name, name_orig, year, views_cnt, synced_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (cat_id, film['id'], film['name'], film.get('name_orig'), film.get('year'),
+                 int(film.get('views_cnt') or 0), now)
+                for film in films
+            ])
 
     @classmethod
-    def delete_film_by_id(cls, film_id, table_name):
-        with cls.connect() as conn:
-            cursor = conn.cursor()
-            cursor.execute(f'DELETE FROM {table_name} WHERE id = ?', (film_id,))
-            conn.commit()
+    def _select_in_chunks(cls, query, cat_id, film_ids) -> list[tuple]:
+        """
+        Строки запроса query с условием cat_id = ? AND id IN ({ids}) для всех film_ids.
+        id передаются пачками: у SQLite ограничено число параметров в запросе
+        """
+        film_ids = list(film_ids)
+        rows = []
+        with cls.cursor() as cursor:
+            for start in range(0, len(film_ids), 500):
+                chunk = film_ids[start:start + 500]
+                cursor.execute(query.format(ids=", ".join("?" * len(chunk))), (cat_id, *chunk))
+                rows.extend(cursor.fetchall())
+        return rows
+
+    @classmethod
+    def get_catalogue_fingerprints(cls, cat_id, film_ids) -> dict[int, int]:
+        """views_cnt из копии списка для переданных id: {id: views_cnt}. Неизвестных id в ответе нет"""
+        return dict(cls._select_in_chunks(
+            'SELECT id, views_cnt FROM catalogue_mirror WHERE cat_id = ? AND id IN ({ids})', cat_id, film_ids))
+
+    @classmethod
+    def get_due_postponed_films(cls, cat_id):
+        """Фильмы из копии списка, время повторной проверки которых уже наступило"""
+        with cls.cursor() as cursor:
+            cursor.execute('''
+                SELECT m.id, m.name, m.name_orig, m.year, m.views_cnt
+                FROM film_backoff b
+                JOIN catalogue_mirror m ON m.cat_id = b.cat_id AND m.id = b.id
+                WHERE b.cat_id = ? AND b.next_check_at <= ?
+            ''', (cat_id, time.time()))
+            rows = cursor.fetchall()
+
+        return [
+            Film(id=row[0], name=row[1], name_orig=row[2], year=row[3], views_cnt=row[4])
+            for row in rows
+        ]
+
+    @classmethod
+    def get_release_fingerprints(cls, cat_id, film_ids) -> dict[int, ReleaseFingerprint]:
+        """Отпечатки раздач с прошлой проверки для переданных id: {id: отпечаток}. Неизвестных id в ответе нет"""
+        rows = cls._select_in_chunks(
+            'SELECT id, release_keys, config_digest FROM release_fingerprints WHERE cat_id = ? AND id IN ({ids})',
+            cat_id, film_ids)
+        return {
+            film_id: ReleaseFingerprint(frozenset(release_keys.split()), config_digest)
+            for film_id, release_keys, config_digest in rows
+        }
+
+    @classmethod
+    def save_release_fingerprint(cls, cat_id, film_id, fingerprint: ReleaseFingerprint):
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO release_fingerprints (cat_id, id, config_digest, release_keys, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (cat_id, film_id, fingerprint.config_digest, " ".join(sorted(fingerprint.keys)), time.time()))
+
+    @classmethod
+    def get_cached_search(cls, query, target, ttl):
+        """Возвращает сохраненный ответ TorAPI, если он моложе ttl секунд"""
+        with cls.cursor() as cursor:
+            cursor.execute(
+                'SELECT response FROM search_cache WHERE query = ? AND target = ? AND created_at >= ?',
+                (query, target, time.time() - ttl))
+            row = cursor.fetchone()
+
+        return fast_json.loads(row[0]) if row else None
+
+    @classmethod
+    def save_search_result(cls, query, target, result, max_size):
+        """Сохраняет ответ TorAPI в кэш и удаляет самые старые записи сверх max_size"""
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO search_cache (query, target, response, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (query, target, fast_json.dumps(result), time.time()))
+            cursor.execute('''
+                DELETE FROM search_cache WHERE rowid IN (
+                    SELECT rowid FROM search_cache
+                    ORDER BY created_at DESC
+                    LIMIT -1 OFFSET ?
+                )
+            ''', (max_size,))
+
+    @classmethod
+    def get_cached_magnet(cls, tracker, release_id, ttl):
+        """Возвращает сохраненную magnet-ссылку, если она моложе ttl секунд"""
+        with cls.cursor() as cursor:
+            cursor.execute(
+                'SELECT magnet FROM magnet_cache WHERE tracker = ? AND release_id = ? AND created_at >= ?',
+                (tracker, str(release_id), time.time() - ttl))
+            row = cursor.fetchone()
+
+        return row[0] if row else None
+
+    @classmethod
+    def save_magnet(cls, tracker, release_id, magnet):
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO magnet_cache (tracker, release_id, magnet, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (tracker, str(release_id), magnet, time.time()))
+
+    @classmethod
+    def get_session(cls, key):
+        """Возвращает сохраненные куки сессии, если срок их действия не истек"""
+        with cls.cursor() as cursor:
+            cursor.execute(
+                'SELECT cookies FROM kinotam_session WHERE key = ? AND expires_at > ?', (key, time.time()))
+            row = cursor.fetchone()
+
+        return json.loads(row[0]) if row else None
+
+    @classmethod
+    def save_session(cls, key, cookies, ttl):
+        with cls.transaction() as cursor:
+            cursor.execute('''
+                INSERT OR REPLACE INTO kinotam_session (key, cookies, expires_at)
+                VALUES (?, ?, ?)
+            ''', (key, json.dumps(cookies), time.time() + ttl))
+
+    @classmethod
+    def postpone_film(cls, cat_id, film_id, base_delay, max_delay, factor=1.0):
+        """
+        Откладывает следующую проверку фильма: задержка удваивается с каждой
+        неудачной попыткой и ограничена max_delay. Возвращает задержку в секундах.
+        """
+        with cls.transaction() as cursor:
+            cursor.execute(
+                'SELECT attempts FROM film_backoff WHERE cat_id = ? AND id = ?', (cat_id, film_id))
+            row = cursor.fetchone()
+            attempts = (row[0] if row else 0) + 1
+
+            delay = min(base_delay * 2 ** min(attempts - 1, 32), max_delay) * factor
+            cursor.execute('''
+                INSERT OR REPLACE INTO film_backoff (cat_id, id, attempts, next_check_at)
+                VALUES (?, ?, ?, ?)
+            ''', (cat_id, film_id, attempts, time.time() + delay))
+
+        return delay
+
+    @classmethod
+    def reset_backoff(cls, cat_id, film_id):
+        with cls.transaction() as cursor:
+            cursor.execute('DELETE FROM film_backoff WHERE cat_id = ? AND id = ?', (cat_id, film_id))
+
+    @classmethod
+    def get_postponed_ids(cls, cat_id):
+        """Id фильмов, время повторной проверки которых еще не наступило"""
+        with cls.cursor() as cursor:
+            cursor.execute(
+                'SELECT id FROM film_backoff WHERE cat_id = ? AND next_check_at > ?', (cat_id, time.time()))
+            return {row[0] for row in cursor.fetchall()}
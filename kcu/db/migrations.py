@@ -0,0 +1,178 @@
+import time
+from sqlite3 import Cursor
+
+from config.log_config import logger
+from config.settings import Settings
+
+
+def _table_exists(cursor: Cursor, table_name: str) -> bool:
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table_name,))
+    return cursor.fetchone() is not None
+
+
+def create_cache_tables(cursor: Cursor, app_settings: Settings):
+    """Кэш поиска TorAPI и расписание повторных проверок"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS search_cache (
+            query      TEXT NOT NULL,
+            target     TEXT NOT NULL,
+            response   TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (query, target)
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_search_cache_created_at ON search_cache (created_at)')
+
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS film_backoff (
+            cat_id        INTEGER NOT NULL,
+            id            INTEGER NOT NULL,
+            attempts      INTEGER NOT NULL,
+            next_check_at REAL NOT NULL,
+            PRIMARY KEY (cat_id, id)
+        )
+    ''')
+
+
+def create_film_state(cursor: Cursor, app_settings: Settings):
+    """
+    Единая таблица состояния фильмов вместо пары таблиц good/bad.
+    Старые таблицы из TABLE_GOOD_QUALITY и TABLE_BAD_QUALITY переносятся
+    с категорией текущего профиля и остаются в БД нетронутыми.
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS film_state (
+            cat_id          INTEGER NOT NULL,
+            id              INTEGER NOT NULL,
+            name            TEXT NOT NULL,
+            name_orig       TEXT,
+            year            INTEGER,
+            status          TEXT NOT NULL,
+            tag             TEXT,
+            priority        INTEGER,
+            release_id      TEXT,
+            tracker         TEXT,
+            created_at      REAL NOT NULL,
+            updated_at      REAL NOT NULL,
+            last_checked_at REAL,
+            PRIMARY KEY (cat_id, id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_film_state_status_checked
+        ON film_state (cat_id, status, last_checked_at)
+    ''')
+
+    now = time.time()
+    # Сначала плохое качество, потом хорошее: если фильм есть в обеих таблицах, побеждает хорошее
+    for table_name, status in (
+        (app_settings.table_bad_quality, "bad"),
+        (app_settings.table_good_quality, "good"),
+    ):
+        if not _table_exists(cursor, table_name):
+            continue
+        cursor.execute(f'''
+            INSERT OR REPLACE INTO film_state
+                (cat_id, id, name, name_orig, year, status, created_at, updated_at)
+            SELECT ?, id, name, name_orig, year, ?, ?, ?
+            FROM {table_name}
+        ''', (app_settings.cat_id, status, now, now))
+        logger.info(f"Перенесено {cursor.rowcount} фильмов из {table_name} в film_state ({status})")
+
+
+def create_magnet_cache(cursor: Cursor, app_settings: Settings):
+    """Кэш magnet-ссылок по (трекер, id раздачи)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS magnet_cache (
+            tracker    TEXT NOT NULL,
+            release_id TEXT NOT NULL,
+            magnet     TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (tracker, release_id)
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_magnet_cache_created_at ON magnet_cache (created_at)')
+
+
+def create_kinotam_session(cursor: Cursor, app_settings: Settings):
+    """Сохраненная сессия Kinotam, общая для всех процессов с этой БД"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS kinotam_session (
+            key        TEXT PRIMARY KEY,
+            cookies    TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+
+def create_catalogue_mirror(cursor: Cursor, app_settings: Settings):
+    """Копия списка фильмов Kinotam с views_cnt на момент последней обработки"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalogue_mirror (
+            cat_id    INTEGER NOT NULL,
+            id        INTEGER NOT NULL,
+            name      TEXT NOT NULL,
+            name_orig TEXT,
+            year      INTEGER,
+            views_cnt INTEGER NOT NULL,
+            synced_at REAL NOT NULL,
+            PRIMARY KEY (cat_id, id)
+        )
+    ''')
+
+
+def create_upload_journal(cursor: Cursor, app_settings: Settings):
+    """
+    Журнал загрузок: найденный релиз с magnet-ссылкой хранится до тех пор,
+    пока фильм не будет залит, поэтому после перезапуска работа не теряется
+    """
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS upload_journal (
+            cat_id     INTEGER NOT NULL,
+            id         INTEGER NOT NULL,
+            state      TEXT NOT NULL,
+            name       TEXT NOT NULL,
+            name_orig  TEXT,
+            year       INTEGER,
+            status     TEXT NOT NULL,
+            tag        TEXT,
+            priority   INTEGER,
+            release_id TEXT,
+            tracker    TEXT,
+            payload    TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (cat_id, id)
+        )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_upload_journal_state ON upload_journal (cat_id, state, updated_at)')
+
+
+def create_release_fingerprints(cursor: Cursor, app_settings: Settings):
+    """Отпечатки наборов раздач фильмов с плохим качеством на момент последней проверки"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS release_fingerprints (
+            cat_id        INTEGER NOT NULL,
+            id            INTEGER NOT NULL,
+            config_digest TEXT NOT NULL,
+            release_keys  TEXT NOT NULL,
+            updated_at    REAL NOT NULL,
+            PRIMARY KEY (cat_id, id)
+        )
+    ''')
+
+
+# Версии применяются по порядку и записываются в schema_migrations.
+# Учет ведется по категории: старые таблицы у каждого профиля свои.
+MIGRATIONS = [
+    (1, "Кэш поиска и расписание проверок", create_cache_tables),
+    (2, "Единая таблица film_state", create_film_state),
+    (3, "Кэш magnet-ссылок", create_magnet_cache),
+    (4, "Сессия Kinotam", create_kinotam_session),
+    (5, "Копия списка фильмов Kinotam", create_catalogue_mirror),
+    (6, "Журнал загрузок", create_upload_journal),
+    (7, "Отпечатки наборов раздач", create_release_fingerprints),
+]
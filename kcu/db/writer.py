@@ -0,0 +1,122 @@
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Callable
+
+from config.log_config import logger
+from core import metrics
+from db.db import Database
+
+# Маркер остановки потока записи
+_STOP = object()
+
+
+class DatabaseWriter:
+    """
+    Отложенная запись в БД (write-behind).
+
+    Стадии конвейера не пишут в БД сами, а ставят вызовы методов Database
+    в очередь через submit(). Отдельный поток забирает из очереди все, что
+    накопилось (не больше batch_size), и выполняет одной транзакцией. Если
+    пачка не записалась, вызовы повторяются по одному, чтобы ошибка в одном
+    не потеряла остальные.
+
+    Пока поток не запущен (скрипты, бенчмарки), submit() выполняет вызов сразу.
+    """
+    _queue: queue.SimpleQueue = queue.SimpleQueue()
+    _thread: threading.Thread | None = None
+    _batch_size = 200
+
+    @classmethod
+    def start(cls, batch_size: int = 200):
+        if cls._thread is not None:
+            return
+        cls._batch_size = max(1, batch_size)
+        cls._thread = threading.Thread(target=cls._run, name="db-writer", daemon=True)
+        cls._thread.start()
+        metrics.DB_WRITE_QUEUE.set_function(cls._queue.qsize)
+
+    @classmethod
+    def submit(cls, func: Callable, *args) -> Future:
+        """
+        Ставит вызов func(*args) в очередь. Возвращает Future с результатом,
+        ждать его не обязательно.
+        """
+        future = Future()
+        if cls._thread is None:
+            cls._execute(func, args, future)
+        else:
+            cls._queue.put((func, args, future))
+        return future
+
+    @classmethod
+    def flush(cls, timeout: float | None = None):
+        """Блокирует вызывающий поток, пока не будет записано все, что поставлено в очередь до вызова"""
+        if cls._thread is None:
+            return
+        marker = Future()
+        cls._queue.put((None, (), marker))
+        marker.result(timeout)
+
+    @classmethod
+    def stop(cls, timeout: float | None = 30.0):
+        """Дописывает очередь и останавливает поток"""
+        thread = cls._thread
+        if thread is None:
+            return
+        cls._queue.put((_STOP, (), None))
+        thread.join(timeout)
+        cls._thread = None
+        if thread.is_alive():
+            logger.error(f"Поток записи в БД не успел дописать очередь за {timeout} с")
+        else:
+            logger.info("Очередь записи в БД дописана")
+
+    @classmethod
+    def _run(cls):
+        while True:
+            batch = [cls._queue.get()]
+            while len(batch) < cls._batch_size:
+                try:
+                    batch.append(cls._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            cls._apply([entry for entry in batch if entry[0] is not None and entry[0] is not _STOP])
+
+            # Маркеры flush() отпускаем только после записи всего, что было перед ними
+            for func, _, future in batch:
+                if func is None:
+                    future.set_result(None)
+            if any(func is _STOP for func, _, _ in batch):
+                return
+
+    @classmethod
+    def _apply(cls, writes):
+        if not writes:
+            return
+        try:
+            with Database.transaction():
+                results = [func(*args) for func, args, _ in writes]
+        except Exception as e:
+            logger.warning(f"Пачка из {len(writes)} записей в БД не записалась ({e}), записываю по одной")
+            results = None
+
+        if results is None:
+            for func, args, future in writes:
+                cls._execute(func, args, future)
+            return
+
+        for (_, _, future), result in zip(writes, results):
+            future.set_result(result)
+
+    @staticmethod
+    def _execute(func, args, future: Future):
+        try:
+            with Database.transaction():
+                result = func(*args)
+        except Exception as e:
+            logger.exception(f"Ошибка записи в БД ({func.__name__}): {e}")
+            future.set_exception(e)
+        else:
+            future.set_result(result)
@@ -1,133 +1,432 @@
 import asyncio
 import json
+import signal
+import time
+from contextlib import aclosing
+from functools import partial
 
 import httpx
-from config.log_config import logger
-from config.settings import Settings, settings
-from core.api_torrent import get_magnet_link, search_by_name
+from config.log_config import FilmLogger, SkipSampler, logger
+from config.settings import Settings, load_profiles, settings
+from config.watcher import watch_config
+from core import metrics
+from core.api_torrent import (
+    SearchError,
+    get_magnet_link,
+    magnet_cache_stats,
+    magnet_flights,
+    search_cache_stats,
+    search_flights,
+    search_releases,
+    torapi_limiter,
+)
 from core.filters import filter_best_quality, filter_releases, seed_count_filter
 from core.kinotam import Kinotam
+from core.pipeline import Stage, UploadThrottle, run_pipeline
+from core.release_fingerprint import ReleaseFingerprint
+from core.scheduler import CycleBudget, rank_tasks
 from db.db import Database
-from models.film import Film
+from db.writer import DatabaseWriter
+from models.film import Film, FilmStatus, FilmTask, UploadState
 
 
-async def process_film(
+def postpone_film(app_settings: Settings, film: Film, views: int, fingerprint: ReleaseFingerprint | None = None):
+    """
+    Откладывает следующую проверку фильма, для которого не нашлось подходящего релиза
+    или не удалась загрузка.
+    Если передан отпечаток раздач, он сохраняется: при следующей проверке эти раздачи
+    уже не рассматриваются. Отпечаток с найденным обновлением не сохраняется, чтобы
+    после неудачной загрузки обновление нашлось снова.
+    """
+    if fingerprint is not None:
+        DatabaseWriter.submit(Database.save_release_fingerprint, app_settings.cat_id, film.get('id'), fingerprint)
+
+    if app_settings.backoff_base_delay <= 0:
+        return
+
+    factor = 1.0
+    if 0 < app_settings.backoff_popular_views <= views:
+        factor = app_settings.backoff_popular_factor
+
+    def log_delay(future):
+        if not future.exception():
+            FilmLogger(film).info(
+                f"Следующая проверка фильма {film.get('name')} (id: {film.get('id')}) через {future.result() / 3600:.1f} ч")
+
+    DatabaseWriter.submit(
+        Database.postpone_film,
+        app_settings.cat_id,
+        film.get('id'),
+        app_settings.backoff_base_delay,
+        app_settings.backoff_max_delay,
+        factor,
+    ).add_done_callback(log_delay)
+
+
+def remember_film(app_settings: Settings, task: FilmTask):
+    """
+    Запоминает фильм из списка Kinotam с текущим views_cnt: при инкрементальной
+    синхронизации он не будет обрабатываться снова, пока views_cnt не изменится.
+    Вызывается только для окончательного итога: пропуск, откладывание или загрузка.
+    """
+    if not task.update_mode:
+        DatabaseWriter.submit(Database.save_catalogue_films, app_settings.cat_id, [task.film])
+
+
+async def search_film(
     app_settings: Settings,
     client,
-    film: Film,
+    task: FilmTask,
     uploaded_ids,
-    update_mode=False,
-):
+    postponed_ids,
+    skips: SkipSampler,
+    budget: CycleBudget,
+) -> FilmTask | None:
+    film = task.film
+    log = FilmLogger(film)
     kinotam_id = film.get('id')
-    name_local = film.get('name')
-    name_orig = film.get('name_orig')
-    year = (film.get('year'))
     views = int(film.get("views_cnt", 0))
 
-    if not update_mode and views < app_settings.min_views:
-        logger.info(
-            f"Фильм {film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')}) имеет меньше {app_settings.min_views} просмотров ({film.get('views_cnt')}), пропускаем")
+    if not task.update_mode and views < app_settings.min_views:
+        skips.log(log, "мало просмотров",
+                  f"Фильм {log.label} имеет меньше {app_settings.min_views} просмотров ({film.get('views_cnt')}), пропускаем")
+        remember_film(app_settings, task)
         return None
 
-    if not update_mode and kinotam_id in uploaded_ids:
-        logger.info(f"Фильм {film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')}) уже залит, пропускаем")
+    if not task.update_mode and kinotam_id in uploaded_ids:
+        skips.log(log, "уже залит", f"Фильм {log.label} уже залит, пропускаем")
+        remember_film(app_settings, task)
         return None
 
-    full_name = " / ".join(str(part) for part in (name_local, name_orig, year) if part)
-    full_name_to_upload = " | ".join(str(part) for part in (name_local, name_orig, year) if part)
+    if kinotam_id in postponed_ids:
+        remember_film(app_settings, task)
+        return None
+
+    # Фильм не запоминается и не отмечается проверенным, поэтому попадет в следующий цикл
+    if not budget.take():
+        skips.log(log, "бюджет цикла", f"Бюджет цикла исчерпан, фильм {log.label} переносится на следующий цикл")
+        return None
+
+    if task.update_mode:
+        log.info(f"Проверяю фильм с плохим качеством на наличие обновлений {log.label}")
+
     try:
-        search_result = await search_by_name(app_settings, client, full_name)
-    except (httpx.HTTPStatusError, json.JSONDecodeError) as e:
-        logger.error(f"Ошибка при поиске релиза для фильма {film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')}): {e}")
+        task.search_result = await search_releases(
+            app_settings, client, task.full_name, russian=film.get('name_orig') is None)
+    except (httpx.HTTPError, json.JSONDecodeError, SearchError) as e:
+        log.error(f"Ошибка при поиске релиза для фильма {log.label}: {e}")
         return None
-    required_filtered = filter_releases(app_settings, search_result, name_local, name_orig, year)
+    if task.update_mode:
+        DatabaseWriter.submit(Database.mark_checked, app_settings.cat_id, [kinotam_id])
+
+    return task
+
+
+async def select_release(
+    app_settings: Settings,
+    task: FilmTask,
+    skips: SkipSampler,
+    fingerprints: dict[int, ReleaseFingerprint],
+) -> FilmTask | None:
+    film = task.film
+    log = FilmLogger(film)
+    views = int(film.get("views_cnt", 0))
+    releases = task.search_result
+    task.search_result = None
+
+    # Фильм с плохим качеством: проверяем только раздачи, появившиеся после прошлой проверки
+    fingerprint = None
+    if task.update_mode:
+        fingerprint = ReleaseFingerprint.of(releases, app_settings.release_config.digest)
+        previous = fingerprints.get(film.get('id'))
+        if previous is not None and previous.config_digest == fingerprint.config_digest:
+            releases = previous.new_releases(releases)
+            if not releases:
+                skips.log(log, "раздачи не изменились",
+                          f"Раздачи фильма {log.label} не изменились с прошлой проверки, пропускаем")
+                postpone_film(app_settings, film, views)
+                remember_film(app_settings, task)
+                return None
+
+    required_filtered = filter_releases(
+        app_settings, releases, film.get('name'), film.get('name_orig'), film.get('year'))
 
     if not required_filtered:
-        logger.info(f"Не найдено подходящих релизов для фильма {film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')})")
+        log.info(f"Не найдено подходящих релизов для фильма {log.label}")
+        postpone_film(app_settings, film, views, fingerprint)
+        remember_film(app_settings, task)
         return None
 
-    if update_mode:
-        best_item = filter_best_quality(app_settings, required_filtered, film, update=True)
-        if not best_item:
-            logger.info(f"Обновлений не найдено для фильма {film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')})")
-            return None
-    else:
-        best_item = filter_best_quality(app_settings, required_filtered, film)
+    status, best_items = filter_best_quality(app_settings, required_filtered, film, update=task.update_mode)
+    if not best_items:
+        if task.update_mode:
+            log.info(f"Обновлений не найдено для фильма {log.label}")
+        else:
+            log.info(f"Не найдено релизов с известным качеством для фильма {log.label}")
+        postpone_film(app_settings, film, views, fingerprint)
+        remember_film(app_settings, task)
+        return None
+
+    task.status = status
+    task.best_item = seed_count_filter(best_items)
+    DatabaseWriter.submit(Database.reset_backoff, app_settings.cat_id, film.get('id'))
+    return task
+
 
-    best_item = seed_count_filter(best_item)
-    magnet_link = await get_magnet_link(app_settings, client, best_item["tracker"], best_item["Id"])
+async def resolve_magnet(app_settings: Settings, client, task: FilmTask) -> FilmTask | None:
+    film = task.film
+    best_item = task.best_item
+    magnet_link = await get_magnet_link(app_settings, client, best_item.tracker, best_item.id)
 
     if not magnet_link:
-        logger.warning(f"Не удалось получить magnet-ссылку для фильма {film.get('name')} (id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')})")
+        log = FilmLogger(film)
+        # Фильм не запоминается в копии списка, поэтому в следующем цикле будет найден заново
+        log.warning(f"Не удалось получить magnet-ссылку для фильма {log.label}")
         return None
 
-    return {
-        "id": kinotam_id,
-        "kinotam_name": full_name_to_upload,
-        "name_release": best_item.get("Name"),
-        "name_to_api": " | ".join(part for part in (full_name_to_upload, best_item.get('Tag')) if part),
-        "url": best_item.get("Url"),
+    task.film_to_upload = film_to_upload = {
+        "id": film.get('id'),
+        "kinotam_name": task.full_name_to_upload,
+        "name_release": best_item.name,
+        "name_to_api": " | ".join(part for part in (task.full_name_to_upload, best_item.tag) if part),
+        "url": best_item.url,
         "magnet": magnet_link
     }
+    # Состояние фильма сохраняется только после загрузки, до этого результат поиска хранится в журнале
+    DatabaseWriter.submit(Database.journal_upload, app_settings.cat_id, film, task.status, best_item, film_to_upload)
+    return task
 
 
-async def main():
-    Database.init()
+async def upload_task(app_settings: Settings, kinotam_api: Kinotam, throttle: UploadThrottle, task: FilmTask, final_result):
+    if not await upload_result(app_settings, kinotam_api, throttle, task.film_to_upload, final_result):
+        # Неудачная загрузка откладывается, как и фильм без подходящего релиза
+        postpone_film(app_settings, task.film, int(task.film.get("views_cnt", 0)))
+    remember_film(app_settings, task)
 
-    semaphore = asyncio.Semaphore(10)  # Лимит в 10 параллельных задач
 
-    async with httpx.AsyncClient(timeout=20.0) as client:
-        while True:
+async def upload_result(app_settings: Settings, kinotam_api: Kinotam, throttle: UploadThrottle, film_to_upload, final_result) -> bool:
+    """Загружает фильм из журнала на Kinotam. True, если фильм залит"""
+    cat_id = app_settings.cat_id
+    film_id = film_to_upload.get('id')
+    if app_settings.debug:
+        final_result.append(film_to_upload)
+        DatabaseWriter.submit(Database.complete_upload, cat_id, film_id)
+        return True
 
-            kinotam_api = Kinotam(settings)
+    await throttle.wait()
+    DatabaseWriter.submit(Database.set_upload_state, cat_id, film_id, UploadState.UPLOADING)
+    logger.info(f"Загружаю фильм [{film_id}] | {film_to_upload.get('name_to_api')}")
+    uploaded = await kinotam_api.upload_film(film_to_upload)
+    throttle.mark()
 
-            films = kinotam_api.get_films_to_process(
-                settings.get_film_retries,
-                settings.get_film_delay,
-            )
-            films_uploaded = Database.get_all_films(settings.table_good_quality)
-            films_to_update = Database.get_all_films(settings.table_bad_quality)
+    if uploaded:
+        DatabaseWriter.submit(Database.complete_upload, cat_id, film_id)
+    else:
+        # Фильм не отмечен обработанным и будет найден заново после отложенной проверки
+        DatabaseWriter.submit(Database.set_upload_state, cat_id, film_id, UploadState.FAILED)
+    return uploaded
+
+
+async def resume_uploads(app_settings: Settings, kinotam_api: Kinotam, throttle: UploadThrottle, final_result):
+    """
+    Загружает фильмы, которые остались в журнале незалитыми, например после
+    перезапуска посреди загрузки. Повторная загрузка безопасна: дубль Kinotam
+    отклоняет, и такой фильм тоже считается залитым.
+    """
+    DatabaseWriter.submit(
+        Database.prune_upload_journal, app_settings.cat_id, time.time() - app_settings.upload_journal_ttl)
+
+    pending = Database.get_pending_uploads(app_settings.cat_id)
+    if not pending:
+        return
 
-            uploaded_ids = {film['id'] for film in (films_uploaded + films_to_update)}  # select id from good union select id from bad
+    logger.info(f"[{app_settings.app_name}] Незалитых фильмов в журнале: {len(pending)}, загружаю")
+    for film_to_upload in pending:
+        if not await upload_result(app_settings, kinotam_api, throttle, film_to_upload, final_result):
+            # views_cnt в журнале не хранится, задержка считается как для обычного фильма
+            film = {"id": film_to_upload.get('id'), "name": film_to_upload.get('kinotam_name')}
+            postpone_film(app_settings, film, 0)
+    # Фильмы из журнала должны попасть в film_state до чтения списка залитых
+    await asyncio.to_thread(DatabaseWriter.flush)
 
-            async def process_with_semaphore(film, is_update=False):
-                """Обработка фильма с ограничением числа параллельных задач"""
-                async with semaphore:
-                    if is_update:
+
+async def run_cycle(
+    app_settings: Settings,
+    client,
+    kinotam_api: Kinotam,
+    throttle: UploadThrottle,
+    full_sync: bool = True,
+):
+    """
+    Один проход по фильмам профиля: поиск, выбор релиза, magnet-ссылка, загрузка.
+    Если full_sync=False, список фильмов синхронизируется инкрементально.
+    """
+    cycle_start = time.monotonic()
+    await kinotam_api.ensure_session()
+
+    final_result = []
+    await resume_uploads(app_settings, kinotam_api, throttle, final_result)
+
+    uploaded_ids = Database.get_known_ids(app_settings.cat_id)
+    films_to_update = Database.get_films_by_status(
+        app_settings.cat_id,
+        FilmStatus.BAD,
+        checked_before=time.time() - app_settings.recheck_interval,
+    )
+    # Отпечатки раздач читаются одним запросом, а не на каждый фильм в стадии фильтрации
+    fingerprints = Database.get_release_fingerprints(app_settings.cat_id, [film['id'] for film in films_to_update])
+
+    # Фильмы, повторная проверка которых еще не наступила
+    postponed_ids = Database.get_postponed_ids(app_settings.cat_id)
+    if postponed_ids:
+        logger.info(f"[{app_settings.app_name}] Отложено до следующих проверок: {len(postponed_ids)} фильмов")
+
+    async def listed_tasks():
+        # Фильмы с плохим качеством уже известны, поэтому идут первыми: бюджет цикла
+        # не должен уходить целиком на список Kinotam
+        for film in films_to_update:
+            yield FilmTask(film, update_mode=True)
+
+        if full_sync:
+            pages = kinotam_api.iter_films_to_process(app_settings.get_film_retries, app_settings.get_film_delay)
+        else:
+            pages = kinotam_api.iter_changed_films(app_settings.get_film_retries, app_settings.get_film_delay)
+
+        listed_ids = set()
+        async with aclosing(pages):
+            async for page in pages:
+                for film in page:
+                    listed_ids.add(film.get('id'))
+                    yield FilmTask(film)
+
+        if not full_sync:
+            # Неизмененные фильмы в список не попадают, поэтому отложенные берем из копии списка
+            for film in Database.get_due_postponed_films(app_settings.cat_id):
+                if film['id'] not in listed_ids:
+                    yield FilmTask(film)
+
+    async def film_source():
+        if app_settings.schedule_mode != "value":
+            # Новые фильмы уходят на поиск по мере получения страниц списка
+            async with aclosing(listed_tasks()) as tasks:
+                async for task in tasks:
+                    if budget.exhausted:
                         logger.info(
-                            f"Проверяю фильм с плохим качеством на наличие обновлений {film.get('name')} "
-                            f"(id: {film.get('id')}, en: {film.get('name_orig')}, year: {film.get('year')})")
-                    return await process_film(
-                        settings,
-                        client,
-                        film,
-                        uploaded_ids,
-                        update_mode=is_update,
-                    )
-                return None
+                            f"[{app_settings.app_name}] Бюджет цикла исчерпан ({budget}), "
+                            f"остальной список фильмов не запрашиваю")
+                        return
+                    yield task
+            return
+
+        # Для сортировки нужен весь список, поиск начинается после получения всех страниц
+        ranked = rank_tasks(
+            [task async for task in listed_tasks()],
+            app_settings.schedule_age_weight,
+            app_settings.schedule_upgrade_weight,
+        )
+        for index, task in enumerate(ranked):
+            if budget.exhausted:
+                logger.info(
+                    f"[{app_settings.app_name}] Бюджет цикла исчерпан ({budget}), "
+                    f"не просмотрено фильмов из списка: {len(ranked) - index}")
+                return
+            yield task
+
+    budget = CycleBudget(app_settings.cycle_time_budget, app_settings.cycle_search_budget)
+    skips = SkipSampler(app_settings.log_skip_every)
+    await run_pipeline(
+        film_source(),
+        [
+            Stage("search", partial(search_film, app_settings, client, uploaded_ids=uploaded_ids, postponed_ids=postponed_ids, skips=skips, budget=budget), app_settings.torapi_max_concurrency),
+            Stage("filter", partial(select_release, app_settings, skips=skips, fingerprints=fingerprints)),
+            Stage("magnet", partial(resolve_magnet, app_settings, client), app_settings.torapi_max_concurrency),
+            Stage("upload", partial(upload_task, app_settings, kinotam_api, throttle, final_result=final_result)),
+        ],
+        app_settings.pipeline_queue_size,
+        name=app_settings.app_name,
+    )
+    # Следующий цикл читает состояние фильмов из БД, поэтому дописываем очередь записи
+    await asyncio.to_thread(DatabaseWriter.flush)
+    # В режиме сводки здесь уходит одно сообщение за весь цикл
+    await kinotam_api.notifier.flush(f"📋 *{app_settings.app_name}: итоги цикла*")
+
+    if skips.counts:
+        logger.info(f"[{app_settings.app_name}] Пропущено фильмов: {skips.summary()}")
+    logger.info(f"Кэш поиска TorAPI (с запуска): {search_cache_stats}")
+    logger.info(f"Кэш magnet-ссылок (с запуска): {magnet_cache_stats}")
+    logger.info(f"Одинаковые запросы (с запуска): поиск - {search_flights}, magnet-ссылки - {magnet_flights}")
+    logger.info(f"Запросы к TorAPI: {torapi_limiter}")
+
+    cycle_duration = time.monotonic() - cycle_start
+    metrics.CYCLE_DURATION.observe(cycle_duration, profile=app_settings.app_name)
+    metrics.CYCLE_LAST_SUCCESS.set(time.time(), profile=app_settings.app_name)
+    logger.info(f"[{app_settings.app_name}] Цикл занял {cycle_duration:.1f} с")
+
+    if app_settings.debug:
+        with open(f"./db_base/result_{app_settings.app_name}.json", "w", encoding="utf-8") as f:
+            logger.info(f"Сохраняю результат в json (DEBUG={app_settings.debug})")
+            json.dump(final_result, f, ensure_ascii=False, indent=2)
+
+
+async def run_profile(app_settings: Settings, client):
+    """Бесконечный цикл обработки для одного профиля со своим расписанием"""
+    Database.init(app_settings)
+
+    throttle = UploadThrottle(app_settings.time_sleep)
+    kinotam_api = await Kinotam.create(app_settings, client)
+
+    cycle = 0
+    try:
+        while True:
+            # Инкрементальный режим периодически проходит весь список, чтобы не пропустить
+            # изменения на страницах после первой неизменившейся
+            full_sync = (
+                app_settings.sync_mode != "incremental"
+                or cycle == 0
+                or (app_settings.sync_full_every > 0 and cycle % app_settings.sync_full_every == 0)
+            )
+            sync_name = "полная" if full_sync else "инкрементальная"
+            logger.info(f"[{app_settings.app_name}] Начинаю обработку (категория {app_settings.cat_id}, синхронизация {sync_name})")
+            await run_cycle(app_settings, client, kinotam_api, throttle, full_sync)
+            cycle += 1
+            logger.info(f"[{app_settings.app_name}] Закончил работу, следующий запуск через {app_settings.restart_time / 60} минут")
+            await asyncio.sleep(app_settings.restart_time)
+    finally:
+        # Дописываем уведомления, которые еще в очереди
+        await kinotam_api.notifier.close()
+
+
+async def main():
+    # docker stop посылает SIGTERM: отменяем main(), чтобы отработали все finally,
+    # дописались уведомления, очередь записи в БД и логи
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    profiles = load_profiles()
+    DatabaseWriter.start(settings.db_write_batch_size)
+
+    # Метрики общие для процесса, поэтому настраиваются в основном окружении
+    background = []
+    metrics_server = await metrics.serve(settings.metrics_port) if settings.metrics_port else None
+    if settings.metrics_file:
+        background.append(metrics.write_periodically(settings.metrics_file, settings.metrics_interval))
+    if settings.config_reload_interval > 0:
+        background.append(watch_config(profiles, settings.config_reload_interval))
+
+    # HTTP-клиент, лимиты TorAPI, кэши и соединение с БД общие для всех профилей
+    async with httpx.AsyncClient(timeout=20.0) as client:
+        try:
+            await asyncio.gather(*background, *(run_profile(profile, client) for profile in profiles))
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
 
-            tasks = []
-            for film in films:
-                tasks.append(process_with_semaphore(film, is_update=False))
-
-            for film in films_to_update:
-                tasks.append(process_with_semaphore(film, is_update=True))
-
-            results = await asyncio.gather(*tasks)
-            final_result = [result for result in results if result]
-
-            if not settings.debug:
-                for film_to_upload in final_result:
-                    logger.info(f"Загружаю фильм [{film_to_upload.get('id')}] | {film_to_upload.get('name_to_api')}")
-                    kinotam_api.upload_film(film_to_upload)
-                    logger.info(f"Ждем {settings.time_sleep / 60} минут до следующей отправки")
-                    await asyncio.sleep(settings.time_sleep)
-            else:
-                with open(f"./db_base/result_{settings.app_name}.json", "w", encoding="utf-8") as f:
-                    logger.info(f"Сохраняю результат в json (DEBUG={settings.debug})")
-                    json.dump(final_result, f, ensure_ascii=False, indent=2)
-            logger.info(f"Закончил работу, следующий запуск через {settings.restart_time / 60} минут")
-            await asyncio.sleep(settings.restart_time)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main())
+    except (asyncio.CancelledError, KeyboardInterrupt):
+        logger.info("Получен сигнал остановки, завершаю работу")
+    finally:
+        DatabaseWriter.stop()
+        Database.close()
@@ -1,3 +1,5 @@
+from dataclasses import dataclass
+from enum import StrEnum
 from typing import TypedDict
 
 
@@ -7,3 +9,111 @@ class Film(TypedDict):
     name_orig: str
     year: int
     views_cnt: int
+
+
+class FilmStatus(StrEnum):
+    GOOD = "good"
+    BAD = "bad"
+
+
+class UploadState(StrEnum):
+    """Состояние записи в журнале загрузок"""
+    RESOLVED = "resolved"
+    UPLOADING = "uploading"
+    UPLOADED = "uploaded"
+    FAILED = "failed"
+
+
+class FilmState(TypedDict):
+    id: int
+    name: str
+    name_orig: str
+    year: int
+    status: FilmStatus
+    tag: str | None
+    priority: int | None
+    release_id: str | None
+    tracker: str | None
+    last_checked_at: float | None
+    views_cnt: int
+
+
+def _parse_size_gb(size) -> float | None:
+    """Размер раздачи в GB из строки вида "1.46 GB" или "700 MB" """
+    try:
+        value, unit = str(size).replace('\xa0', ' ').split()
+        value = float(value)
+    except ValueError:
+        return None
+    unit = unit.upper()
+    return value if unit == "GB" else value / 1024 if unit == "MB" else None
+
+
+def _parse_int(value) -> int:
+    try:
+        return int(value)
+    except (ValueError, TypeError):
+        return 0
+
+
+@dataclass(slots=True)
+class Release:
+    """Раздача из ответа TorAPI с уже разобранными размером и числом сидов"""
+    tracker: str
+    id: str
+    name: str
+    url: str | None
+    category: str | None
+    size_gb: float | None
+    seeds: int
+    # Заполняются при выборе качества
+    tag: str | None = None
+    priority: int | None = None
+
+    @classmethod
+    def from_torapi(cls, tracker: str, item: dict) -> "Release":
+        return cls(
+            tracker=tracker,
+            id=str(item.get("Id", "")),
+            name=str(item.get("Name", "")),
+            url=item.get("Url"),
+            category=item.get("Category"),
+            size_gb=_parse_size_gb(item.get("Size", "")),
+            seeds=_parse_int(item.get("Seeds")),
+        )
+
+
+def decode_releases(raw) -> dict[str, list[Release]]:
+    """
+    Ответ поиска TorAPI в формате {трекер: [раздачи]} -> {трекер: [Release]}.
+    Трекеры, вместо списка вернувшие сообщение (например, "No matches"), пропускаются.
+    """
+    if not isinstance(raw, dict):
+        return {}
+    return {
+        tracker: [Release.from_torapi(tracker, item) for item in items if isinstance(item, dict)]
+        for tracker, items in raw.items()
+        if isinstance(items, list)
+    }
+
+
+@dataclass(slots=True)
+class FilmTask:
+    """Фильм, проходящий через стадии обработки, и промежуточные результаты"""
+    film: Film
+    update_mode: bool = False
+    search_result: dict[str, list[Release]] | None = None
+    status: FilmStatus | None = None
+    best_item: Release | None = None
+    film_to_upload: dict | None = None
+
+    @property
+    def full_name(self) -> str:
+        return " / ".join(str(part) for part in self._name_parts() if part)
+
+    @property
+    def full_name_to_upload(self) -> str:
+        return " | ".join(str(part) for part in self._name_parts() if part)
+
+    def _name_parts(self):
+        return self.film.get('name'), self.film.get('name_orig'), self.film.get('year')
@@ -0,0 +1,198 @@
+import asyncio
+import time
+
+import httpx
+from config.log_config import logger
+from config.settings import Settings
+from core import metrics
+
+# Ограничение Telegram на длину одного сообщения
+MAX_MESSAGE_LENGTH = 4096
+
+
+class TelegramNotifier:
+    """
+    Асинхронная отправка уведомлений в Telegram.
+
+    notify() только ставит сообщение в ограниченную очередь и сразу возвращает
+    управление, отправляет фоновая задача: не чаще раза в min_interval секунд,
+    при 429 ждет retry_after из ответа Telegram, при сетевых ошибках повторяет
+    с растущей паузой. Если очередь заполнена, новое сообщение отбрасывается,
+    загрузка фильмов из-за Telegram не останавливается.
+
+    В режиме digest сообщения за цикл копятся и уходят одной сводкой в flush().
+    """
+
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        api_url: str,
+        token: str,
+        chat_id: str,
+        queue_size: int = 100,
+        max_retries: int = 3,
+        min_interval: float = 1.0,
+        digest: bool = False,
+        timeout: float = 10.0,
+    ):
+        self.client = client
+        self.url = f"{api_url}/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.enabled = bool(token and chat_id)
+        self.max_retries = max_retries
+        self.min_interval = min_interval
+        self.digest = digest
+        self.timeout = timeout
+
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=queue_size)
+        self._digest_lines: list[str] = []
+        self._worker: asyncio.Task | None = None
+        self._last_sent = 0.0
+
+    @classmethod
+    def from_settings(cls, app_settings: Settings, client: httpx.AsyncClient) -> "TelegramNotifier":
+        return cls(
+            client,
+            app_settings.tg_api_url,
+            app_settings.tg_token,
+            app_settings.tg_chat_id,
+            queue_size=app_settings.tg_queue_size,
+            max_retries=app_settings.tg_retries,
+            min_interval=app_settings.tg_min_interval,
+            digest=app_settings.tg_digest,
+        )
+
+    def notify(self, text: str, summary: str | None = None):
+        """
+        Ставит сообщение в очередь. В режиме digest вместо него в сводку
+        попадает summary (или сам текст, если summary не задан).
+        """
+        if not self.enabled:
+            return
+        if self.digest:
+            self._digest_lines.append(summary or text)
+            return
+        self._enqueue(text)
+
+    async def flush(self, title: str = "", timeout: float = 30.0):
+        """
+        В режиме digest отправляет накопленную сводку и ждет ее отправки не дольше
+        timeout секунд. Без digest сообщения уходят по мере поступления и flush не ждет.
+        """
+        if self._enqueue_digest(title):
+            await self._drain(timeout)
+
+    async def close(self, timeout: float = 30.0):
+        """Дописывает очередь (не дольше timeout секунд) и останавливает фоновую задачу"""
+        self._enqueue_digest()
+        await self._drain(timeout)
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+    def _enqueue_digest(self, title: str = "") -> bool:
+        """Ставит накопленную сводку в очередь. False, если сводка пустая"""
+        if not self._digest_lines:
+            return False
+        lines, self._digest_lines = self._digest_lines, []
+        for message in self._split([f"{title} ({len(lines)})" if title else "", *lines]):
+            self._enqueue(message)
+        return True
+
+    async def _drain(self, timeout: float):
+        if self._worker is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(
+                f"Уведомления в telegram не отправлены за {timeout} с, отправка продолжается в фоне: "
+                f"в очереди {self._queue.qsize()}")
+
+    def _enqueue(self, text: str):
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+        try:
+            self._queue.put_nowait(text)
+        except asyncio.QueueFull:
+            logger.warning(f"Очередь уведомлений telegram заполнена ({self._queue.maxsize}), сообщение отброшено")
+
+    @staticmethod
+    def _split(lines: list[str]) -> list[str]:
+        """Склеивает строки в сообщения не длиннее MAX_MESSAGE_LENGTH"""
+        messages, current = [], ""
+        for line in lines:
+            if not line:
+                continue
+            line = line[:MAX_MESSAGE_LENGTH]
+            if current and len(current) + 1 + len(line) > MAX_MESSAGE_LENGTH:
+                messages.append(current)
+                current = ""
+            current = f"{current}\n{line}" if current else line
+        if current:
+            messages.append(current)
+        return messages
+
+    async def _run(self):
+        while True:
+            text = await self._queue.get()
+            try:
+                await self._send(text)
+            except Exception as e:
+                logger.exception(f"Ошибка при отправке уведомления в telegram: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _send(self, text: str):
+        payload = {
+            'chat_id': self.chat_id,
+            'text': text,
+            'parse_mode': 'Markdown',
+        }
+        for attempt in range(1, self.max_retries + 1):
+            delay = self._last_sent + self.min_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+            try:
+                with metrics.track_request("telegram", "send_message"):
+                    response = await self.client.post(self.url, data=payload, timeout=self.timeout)
+                    self._last_sent = time.monotonic()
+                    if response.status_code != 429 and not response.is_client_error:
+                        response.raise_for_status()
+            except httpx.HTTPError as e:
+                logger.warning(f"[Попытка {attempt}] Ошибка при отправке уведомления в telegram: {e}")
+                await asyncio.sleep(min(2 ** attempt, 30))
+                continue
+
+            if response.status_code == 429:
+                retry_after = self._retry_after(response)
+                logger.warning(f"[Попытка {attempt}] Telegram ограничил частоту отправки, жду {retry_after} с")
+                await asyncio.sleep(retry_after)
+                continue
+
+            if response.is_client_error:
+                # Повтор не поможет: например, Telegram не разобрал разметку сообщения
+                logger.error(
+                    f"Telegram отклонил уведомление ({response.status_code}), сообщение отброшено: "
+                    f"{self._description(response)}")
+                return
+
+            logger.info("Уведомление в telegram отправлено")
+            return
+
+        logger.error(f"Не удалось отправить уведомление в telegram после {self.max_retries} попыток")
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> float:
+        try:
+            return float(response.json().get("parameters", {}).get("retry_after", 1))
+        except (ValueError, AttributeError):
+            return 1.0
+
+    @staticmethod
+    def _description(response: httpx.Response) -> str:
+        try:
+            return str(response.json().get("description", response.text))
+        except (ValueError, AttributeError):
+            return response.text[:200]